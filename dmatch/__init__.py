@@ -20,6 +20,8 @@ from rules import *
 try:
     from distro import *
     from matcher import *
+    from parallel import *
+    from matchcache import *
     HAVE_ENGINE=True
 except ImportError, e:
     HAVE_ENGINE=False
@@ -0,0 +1,213 @@
+# distromatch - Match binary package names across distributions
+#
+# Copyright (C) 2011  Enrico Zini <enrico@enricozini.org>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# Compact, columnar storage for sorted lists of (pkg, kind, path) tuples.
+#
+# File layout (all integers are little endian uint32):
+#
+#   header: magic, number of packages, kinds and rows
+#   package names: offsets table (n_pkgs + 1 entries) and string blob
+#   kind names: offsets table (n_kinds + 1 entries) and string blob
+#   rows: package index column, kind index column
+#   paths: offsets table (n_rows + 1 entries) and string blob
+#
+# Files are accessed through mmap, without deserialising them.
+
+import os
+import sys
+import mmap
+import shutil
+import struct
+import tempfile
+from array import array
+import utils
+
+MAGIC = "DMCC0001"
+HEADER = struct.Struct("<8sIII")
+
+def write_array(fd, arr):
+    "Write an array('I') in little endian order"
+    if sys.byteorder != "little":
+        arr = array("I", arr)
+        arr.byteswap()
+    fd.write(arr.tostring())
+
+class StringColumn(object):
+    """
+    Build a table of strings as an offsets table plus a blob. The blob is
+    kept on disk, the offsets in memory: use it for interned strings only.
+    """
+    def __init__(self, tmpdir=None):
+        self.offsets = array("I", [0])
+        self.blob = tempfile.TemporaryFile(dir=tmpdir)
+        self.size = 0
+
+    def append(self, s):
+        self.blob.write(s)
+        self.size += len(s)
+        self.offsets.append(self.size)
+        return len(self.offsets) - 2
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def write(self, out):
+        write_array(out, self.offsets)
+        self.blob.seek(0)
+        shutil.copyfileobj(self.blob, out)
+        self.blob.close()
+
+class IntColumn(object):
+    "Build a column of integers on disk"
+    def __init__(self, tmpdir=None, buffer_size=65536):
+        self.buf = array("I")
+        self.fd = tempfile.TemporaryFile(dir=tmpdir)
+        self.buffer_size = buffer_size
+
+    def append(self, val):
+        self.buf.append(val)
+        if len(self.buf) >= self.buffer_size:
+            write_array(self.fd, self.buf)
+            self.buf = array("I")
+
+    def write(self, out):
+        write_array(self.fd, self.buf)
+        self.fd.seek(0)
+        shutil.copyfileobj(self.fd, out)
+        self.fd.close()
+
+def write(fname, items, tmpdir=None):
+    """
+    Write the sorted (pkg, kind, path) tuples in items to fname, atomically.
+
+    Returns the number of rows written.
+    """
+    if tmpdir is None:
+        tmpdir = os.path.dirname(os.path.abspath(fname))
+    pkgs = StringColumn(tmpdir)
+    kinds = dict()
+    col_pkg = IntColumn(tmpdir)
+    col_kind = IntColumn(tmpdir)
+    # The path offsets table grows with the rows: keep it on disk
+    path_offsets = IntColumn(tmpdir)
+    path_blob = tempfile.TemporaryFile(dir=tmpdir)
+    path_size = 0
+    path_offsets.append(0)
+
+    last_pkg = None
+    pkg_idx = -1
+    count = 0
+    for pkg, kind, path in items:
+        if pkg != last_pkg:
+            pkg_idx = pkgs.append(pkg)
+            last_pkg = pkg
+        kind_idx = kinds.get(kind, None)
+        if kind_idx is None:
+            kind_idx = kinds[kind] = len(kinds)
+        col_pkg.append(pkg_idx)
+        col_kind.append(kind_idx)
+        path_blob.write(path)
+        path_size += len(path)
+        path_offsets.append(path_size)
+        count += 1
+
+    kind_names = StringColumn(tmpdir)
+    for name, idx in sorted(kinds.iteritems(), key=lambda x:x[1]):
+        kind_names.append(name)
+
+    with utils.atomic_writer(fname) as out:
+        out.write(HEADER.pack(MAGIC, len(pkgs), len(kind_names), count))
+        pkgs.write(out)
+        kind_names.write(out)
+        col_pkg.write(out)
+        col_kind.write(out)
+        path_offsets.write(out)
+        path_blob.seek(0)
+        shutil.copyfileobj(path_blob, out)
+        path_blob.close()
+    return count
+
+class Strings(object):
+    "Read access to a string table in a mapped file"
+    def __init__(self, mm, offset, count):
+        self.mm = mm
+        self.offsets = offset
+        self.blob = offset + (count + 1) * 4
+        self.count = count
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, idx):
+        start, end = struct.unpack_from("<II", self.mm, self.offsets + idx * 4)
+        return self.mm[self.blob + start:self.blob + end]
+
+    def blob_size(self):
+        return struct.unpack_from("<I", self.mm, self.offsets + self.count * 4)[0]
+
+class ContentsCache(object):
+    """
+    Read access to a file written by write.
+
+    Iterating it generates the (pkg, kind, path) tuples in sorted order.
+    """
+    def __init__(self, fname):
+        self.fname = fname
+        fd = open(fname, "rb")
+        try:
+            size = os.fstat(fd.fileno()).st_size
+            if size < HEADER.size:
+                raise ValueError("%s: file is too short" % fname)
+            self.mm = mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_READ)
+        finally:
+            fd.close()
+        magic, n_pkgs, n_kinds, self.count = HEADER.unpack_from(self.mm, 0)
+        if magic != MAGIC:
+            raise ValueError("%s: not a contents cache file" % fname)
+        offset = HEADER.size
+        self.pkgs = Strings(self.mm, offset, n_pkgs)
+        offset = self.pkgs.blob + self.pkgs.blob_size()
+        kinds = Strings(self.mm, offset, n_kinds)
+        self.kinds = [kinds[x] for x in range(n_kinds)]
+        offset = kinds.blob + kinds.blob_size()
+        self.col_pkg = offset
+        self.col_kind = self.col_pkg + self.count * 4
+        self.paths = Strings(self.mm, self.col_kind + self.count * 4, self.count)
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, idx):
+        if idx < 0 or idx >= self.count:
+            raise IndexError(idx)
+        pkg = struct.unpack_from("<I", self.mm, self.col_pkg + idx * 4)[0]
+        kind = struct.unpack_from("<I", self.mm, self.col_kind + idx * 4)[0]
+        return self.pkgs[pkg], self.kinds[kind], self.paths[idx]
+
+    def __iter__(self):
+        last_pkg_idx = None
+        pkg = None
+        for idx in xrange(self.count):
+            pkg_idx = struct.unpack_from("<I", self.mm, self.col_pkg + idx * 4)[0]
+            if pkg_idx != last_pkg_idx:
+                pkg = self.pkgs[pkg_idx]
+                last_pkg_idx = pkg_idx
+            kind = struct.unpack_from("<I", self.mm, self.col_kind + idx * 4)[0]
+            yield pkg, self.kinds[kind], self.paths[idx]
+
+    def close(self):
+        self.mm.close()
@@ -20,13 +20,110 @@ import sys
 import xapian
 import os
 import os.path
+import hashlib
+import uuid
+import zlib
+import time
+import shutil
+import tempfile
+import subprocess
 from gzip import GzipFile
+from collections import OrderedDict
 import logging
 from rules import *
 import matcher
+import parallel
+import utils
+from utils import UnsortedInput
+import matchcache
+import matchtable
+import nametable
 
 log = logging.getLogger(__name__)
 
+# Value slot with a digest of the document terms, used by incremental updates
+VALUE_DIGEST = 0
+
+def read_sorted_binsrc(fd):
+    """
+    Generate the unique (bin, src) couples from a binsrc file sorted in byte
+    order, raising UnsortedInput if it turns out not to be sorted
+    """
+    last = None
+    for line in fd:
+        rec = tuple(line.strip().split())
+        if last is not None:
+            if rec == last: continue
+            if rec < last:
+                raise UnsortedInput("binsrc is not sorted: %s comes after %s" % (" ".join(rec), " ".join(last)))
+        last = rec
+        yield rec
+
+def read_sorted_contents(fd, stats=None):
+    """
+    Generate (pkg, dict(kind -> set(fname))) from an interesting-files list
+    sorted in byte order, raising UnsortedInput if it turns out not to be
+    sorted.
+
+    If stats is a dict, count there the number of files of each kind.
+    """
+    cur = None
+    pkginfo = None
+    for line in fd:
+        pkg, kind, fname = line.strip().split(None, 2)
+        if kind == 'desktop' and fname.lower().startswith("fedora-"):
+            fname = fname[7:]
+        if pkg != cur:
+            if cur is not None:
+                if pkg < cur:
+                    raise UnsortedInput("interesting-files is not sorted: %s comes after %s" % (pkg, cur))
+                yield cur, pkginfo
+            cur = pkg
+            pkginfo = dict()
+        pkginfo.setdefault(kind, set()).add(fname)
+        if stats is not None:
+            stats[kind] = stats.get(kind, 0) + 1
+    if cur is not None:
+        yield cur, pkginfo
+
+def shard_of(name, shards):
+    "Return the shard, out of shards, where the package name is indexed"
+    return (zlib.crc32(name) & 0xffffffff) % shards
+
+def compact_databases(sources, dest):
+    """
+    Merge the Xapian databases in sources into a new compacted one in dest,
+    using whatever compaction API the bindings have, or xapian-compact
+    """
+    if hasattr(xapian.Database, "compact"):
+        # Xapian 1.3 and later compact from a combined Database
+        db = xapian.Database()
+        for src in sources:
+            db.add_database(xapian.Database(src))
+        db.compact(dest)
+        return
+    compactor = getattr(xapian, "Compactor", None)
+    if compactor is not None and all([hasattr(compactor, x) for x in ("add_source", "set_destdir", "compact")]):
+        compactor = compactor()
+        for src in sources:
+            compactor.add_source(src)
+        compactor.set_destdir(dest)
+        compactor.compact()
+        return
+    with open(os.devnull, "w") as devnull:
+        try:
+            subprocess.check_call(["xapian-compact"] + list(sources) + [dest], stdout=devnull)
+        except OSError, e:
+            raise RuntimeError("cannot run xapian-compact: %s" % str(e))
+
+def disk_usage(path):
+    "Return the total size of the files in the directory path"
+    res = 0
+    for dirpath, dirnames, filenames in os.walk(path):
+        for fname in filenames:
+            res += os.path.getsize(os.path.join(dirpath, fname))
+    return res
+
 def read_filelist(src):
     "Read a compressed package->file content list"
     fd = GzipFile(src, "r")
@@ -35,37 +132,110 @@ def read_filelist(src):
         name = name.lower()
         yield name, path
 
+class PostingCache(object):
+    """
+    LRU cache of the package names indexed by each term, bounded by the
+    total number of names it holds
+    """
+    def __init__(self, max_size=100000):
+        self.max_size = max_size
+        self.size = 0
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, term):
+        "Return the package names for term, or None if it is not cached"
+        names = self.entries.pop(term, None)
+        if names is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.entries[term] = names
+        return names
+
+    def put(self, term, names):
+        "Store the package names for term, evicting the least recently used"
+        if len(names) > self.max_size:
+            return
+        old = self.entries.pop(term, None)
+        if old is not None:
+            self.size -= len(old)
+        self.entries[term] = names
+        self.size += len(names)
+        while self.size > self.max_size:
+            t, evicted = self.entries.popitem(last=False)
+            self.size -= len(evicted)
+
 class Distro(object):
     "Package information from one distro"
 
-    def __init__(self, name, style=None, reindex=False, root="."):
+    # Maximum number of package names kept in the posting cache
+    posting_cache_size = 100000
+
+    def __init__(self, name, style=None, reindex=False, root=".", incremental=False, shards=1):
         if style is None:
-            style_fname = os.path.join(root, "dist-"+name, "style")
-            try:
-                style = open(style_fname).read().strip()
-            except Exception, e:
-                if name in STEMMERS:
-                    log.info("cannot read style file in %s: %s. Defaulting to %s", style_fname, str(e), name)
-                    style = name
-                else:
-                    raise RuntimeError("cannot read style file in %s: %s" % (style_fname, str(e)))
+            style = self.read_style(name, root)
         self.name = name
         self.style = style
         self.root = os.path.abspath(os.path.join(root, "dist-" + name))
         self.dbpath = os.path.join(self.root, "db")
+        self.name_table_path = os.path.join(self.root, "names.dmnt")
         self.stemmers = STEMMERS[self.style]
-        if reindex or not os.path.exists(self.dbpath):
+        if reindex:
+            self.index(incremental=incremental, shards=shards)
+        elif not os.path.exists(self.dbpath):
+            # The index is opened lazily: check now that it can be built
+            for fname in self.input_files():
+                if not os.path.exists(fname):
+                    raise RuntimeError("no index and no input file %s" % fname)
+
+    @utils.lazy_property
+    def db(self):
+        "Xapian database for this distro, opened (and built if missing) on first use"
+        if not os.path.exists(self.dbpath):
             self.index()
-        self.db = xapian.Database(self.dbpath)
+        # Cached postings belong to the database opened before
+        self.__dict__.pop("postings", None)
+        return xapian.Database(self.dbpath)
+
+    @utils.lazy_property
+    def postings(self):
+        "PostingCache for term_packages, valid for the currently open db"
+        return PostingCache(self.posting_cache_size)
+
+    def term_packages(self, term):
+        "Return the names of the packages indexed by term, using the posting cache"
+        db = self.db
+        names = self.postings.get(term)
+        if names is None:
+            names = tuple([db.get_document(p.docid).get_data() for p in db.postlist(term)])
+            self.postings.put(term, names)
+        return names
+
+    @staticmethod
+    def read_style(name, root="."):
+        "Read the style of the distribution name in root"
+        style_fname = os.path.join(root, "dist-"+name, "style")
+        try:
+            return open(style_fname).read().strip()
+        except Exception, e:
+            if name in STEMMERS:
+                log.info("cannot read style file in %s: %s. Defaulting to %s", style_fname, str(e), name)
+                return name
+            else:
+                raise RuntimeError("cannot read style file in %s: %s" % (style_fname, str(e)))
+
+    @utils.lazy_property
+    def name_table(self):
+        "Name to docid table for this distro, or None if missing or out of date"
+        return nametable.open_table(self.name_table_path, self.generation())
 
     def has_package(self, name):
         "Check if this distribution has a package with the given name"
-        enq = xapian.Enquire(self.db)
-        enq.set_query(xapian.Query("XP"+name.lower()))
-        mset = enq.get_mset(0, 1)
-        for m in mset:
-            return True
-        return False
+        if self.name_table is not None:
+            return self.name_table.lookup(name.lower()) is not None
+        return self.query_document(name) is not None
 
     def open_possibly_compressed(self, fname):
         if os.path.exists(fname):
@@ -75,10 +245,15 @@ class Distro(object):
         else:
             raise ValueError("%s: not found" % fname)
 
+    @utils.lazy_property
+    def package_names(self):
+        "frozenset of all binary packages in this distro, read on first use"
+        fname = os.path.join(self.root, "binsrc")
+        return frozenset([x.strip().split()[0] for x in self.open_possibly_compressed(fname)])
+
     def all_packages(self):
         "Return the set of all binary packages in this distro"
-        fname = os.path.join(self.root, "binsrc")
-        return set([x.strip().split()[0] for x in self.open_possibly_compressed(fname)])
+        return set(self.package_names)
 
     def all_packages_binsrc(self):
         "Return the set of all binary packages in this distro"
@@ -103,16 +278,11 @@ class Distro(object):
     #        print >>out, pkg, kind, fname
     #    out.close()
 
-    def index(self):
-        "Rebuild the Xapian index for this distro"
-        log.info("%s: indexing data", self.name)
-        pkgs = self.all_packages_binsrc()
-        log.info("%s: %d packages", self.name, len(pkgs))
-
-        #if not os.path.exists(os.path.join(os.path.join(self.root, "interesting-files"))):
-        #    self.filter_filelist()
-
-        # Read package contents information
+    def read_contents(self):
+        """
+        Read the interesting-files list of this distro into a dict
+        pkg -> dict(kind -> set(fname))
+        """
         contents = dict()
         contents_stats = dict()
         fname = os.path.join(self.root, "interesting-files")
@@ -128,52 +298,512 @@ class Distro(object):
                 contents_stats[kind] = 1
         for k, v in contents_stats.iteritems():
             log.info("%s: %d %s files", self.name, v, k)
+        return contents
 
-        # Create a new database
-        db = xapian.WritableDatabase(self.dbpath, xapian.DB_CREATE_OR_OVERWRITE)
+    def packages(self):
+        """
+        Generate (name, srcname, pkginfo) for all the packages to index, where
+        pkginfo is a dict(kind -> set(fname)) with the package contents.
+
+        All input is read in memory first, so it does not need to be sorted.
+        """
+        pkgs = self.all_packages_binsrc()
+        log.info("%s: %d packages", self.name, len(pkgs))
+
+        #if not os.path.exists(os.path.join(os.path.join(self.root, "interesting-files"))):
+        #    self.filter_filelist()
+
+        # Read package contents information
+        contents = self.read_contents()
 
-        stem_stats = dict([(x, 0) for x in self.stemmers])
         for name, srcname in pkgs:
-            doc = xapian.Document()
-            doc.set_data(name)
-            lname = name.lower()
-            # Package name term
-            doc.add_term("XP"+lname)
-            doc.add_term("XPS"+srcname)
+            yield name, srcname, contents.get(name, dict())
 
-            # Add stemmed forms of the package name
-            for pfx in self.stemmers:
-                for t in self.stem(lname, pfx):
-                    doc.add_term(pfx + t)
-                    stem_stats[pfx] += 1
+    def packages_sorted(self):
+        """
+        Same as packages, but merge the binsrc and interesting-files lists
+        package by package, using a constant amount of memory.
 
-            # Add package contents
-            pkginfo = contents.get(name, dict())
-            for kind, fnames in pkginfo.iteritems():
-                pfx = CONTENT_INFO[kind].pfx
-                for fn in fnames:
-                    doc.add_term(pfx+fn)
+        Both files must be sorted in byte order (like LC_ALL=C sort), and
+        UnsortedInput is raised as soon as they turn out not to be.
+        """
+        binsrc = read_sorted_binsrc(
+                self.open_possibly_compressed(os.path.join(self.root, "binsrc")))
+        contents_stats = dict()
+        contents = read_sorted_contents(
+                self.open_possibly_compressed(os.path.join(self.root, "interesting-files")),
+                contents_stats)
 
-            db.add_document(doc)
+        count = 0
+        cur = next(contents, None)
+        for name, srcname in binsrc:
+            # Skip the contents of packages that are not in binsrc
+            while cur is not None and cur[0] < name:
+                cur = next(contents, None)
+            if cur is not None and cur[0] == name:
+                yield name, srcname, cur[1]
+            else:
+                yield name, srcname, dict()
+            count += 1
+        # Consume the rest, to check that it is sorted and complete the stats
+        for cur in contents:
+            pass
 
-        for k, v in sorted(stem_stats.iteritems(), key=lambda x:x[0]):
-            log.info("%s: stemmer %s matched %d names", self.name, k, v)
+        log.info("%s: %d packages", self.name, count)
+        for k, v in contents_stats.iteritems():
+            log.info("%s: %d %s files", self.name, v, k)
 
-        db.flush()
+    def each_package(self, func):
+        """
+        Call func(packages) with a generator of the packages to index, as
+        returned by packages_sorted. If the input turns out not to be sorted,
+        call func again with the result of packages.
+        """
+        try:
+            return func(self.packages_sorted())
+        except UnsortedInput, e:
+            log.info("%s: %s: reading all input in memory", self.name, str(e))
+        return func(self.packages())
 
-    def stats(self, out=sys.stderr):
-        "Print stats about the contents of this distro"
-        print >>out, "%s: %d packages" % (self.name, len(self.all_packages()))
+    def make_document(self, name, srcname, pkginfo, stem_stats):
+        "Build the Xapian document for a package"
+        lname = name.lower()
+        # Package name term
+        terms = ["XP"+lname, "XPS"+srcname]
+
+        # Add stemmed forms of the package name
+        for pfx in self.stemmers:
+            for t in self.stem(lname, pfx):
+                terms.append(pfx + t)
+                stem_stats[pfx] += 1
+
+        # Add package contents
+        for kind, fnames in pkginfo.iteritems():
+            pfx = CONTENT_INFO[kind].pfx
+            for fn in fnames:
+                terms.append(pfx+fn)
+
+        doc = xapian.Document()
+        doc.set_data(name)
+        for t in terms:
+            doc.add_term(t)
+
+        # Store a digest of the document, to detect changes when updating
+        terms.sort()
+        digest = hashlib.sha1(name + "\0" + "\0".join(terms)).hexdigest()
+        doc.add_value(VALUE_DIGEST, digest)
+        return doc
+
+    def input_files(self):
+        "Return the pathnames of the input files for the index"
+        res = []
+        for fname in ("binsrc", "interesting-files"):
+            fname = os.path.join(self.root, fname)
+            if not os.path.exists(fname):
+                fname += ".gz"
+            res.append(fname)
+        return res
+
+    def input_stamp(self):
+        """
+        Return a string that changes when the input files are modified, which
+        is cheap to compute
+        """
+        res = []
+        for fname in self.input_files():
+            st = os.stat(fname)
+            res.append("%s:%d:%d" % (os.path.basename(fname), st.st_size, st.st_mtime))
+        return " ".join(res)
+
+    def input_fingerprint(self):
+        """
+        Return a digest of the indexing style and of the uncompressed
+        contents of the input files
+        """
+        digest = hashlib.sha1()
+        digest.update(self.style)
+        digest.update("\0")
+        for fname in ("binsrc", "interesting-files"):
+            fd = self.open_possibly_compressed(os.path.join(self.root, fname))
+            while True:
+                buf = fd.read(256 * 1024)
+                if not buf: break
+                digest.update(buf)
+            digest.update("\0")
+        return digest.hexdigest()
+
+    def index(self, incremental=False, shards=1):
+        """
+        Rebuild the Xapian index for this distro.
+
+        If incremental is True and an index already exists, only update the
+        documents of the packages that changed since the index was built.
+        Otherwise, if shards is more than 1, build the index with
+        index_sharded. The new index is written to a new directory that
+        then replaces the current one with swap_db, so the current one is
+        never modified.
+        """
+        if incremental and os.path.exists(self.dbpath):
+            db = xapian.Database(self.dbpath)
+            if not db.get_metadata("inputs"):
+                log.info("%s: index has no input fingerprint, rebuilding it", self.name)
+            elif db.get_metadata("style") != self.style:
+                # Terms would be generated differently for the new style
+                log.info("%s: index style changed, rebuilding it", self.name)
+            else:
+                self.update(db)
+                return
+            del db
+
+        if shards > 1:
+            self.index_sharded(shards)
+            return
+
+        log.info("%s: indexing data", self.name)
+        start = time.time()
+        stamp = self.input_stamp()
+        fingerprint = self.input_fingerprint()
+
+        generation = self.new_generation()
+        dest = os.path.join(self.root, "db." + generation)
+        try:
+            db, count, stem_stats = self.build_db(dest)
+
+            for k, v in sorted(stem_stats.iteritems(), key=lambda x:x[0]):
+                log.info("%s: stemmer %s matched %d names", self.name, k, v)
+
+            db.set_metadata("inputs", fingerprint)
+            db.set_metadata("style", self.style)
+            db.set_metadata("inputs_stamp", stamp)
+            db.set_metadata("generation", generation)
+            self.store_counts(db, count)
+            db.flush()
+        except:
+            if os.path.exists(dest):
+                shutil.rmtree(dest)
+            raise
+        self.swap_db(dest)
+        self.write_name_table(db)
+        log.info("%s: index built in %.1fs, %d bytes", self.name,
+                 time.time() - start, disk_usage(self.dbpath))
+
+    def build_db(self, path, shard=None, shards=1):
+        """
+        Create a new Xapian database in path with the documents of all the
+        packages, or only of those in the given shard out of shards.
+
+        Returns the database, the number of package names indexed and the
+        number of names matched by each stemmer.
+        """
+        stem_stats = dict()
+        names = set()
+        def build(packages):
+            stem_stats.clear()
+            stem_stats.update([(x, 0) for x in self.stemmers])
+            names.clear()
+            # Create a new database
+            db = xapian.WritableDatabase(path, xapian.DB_CREATE_OR_OVERWRITE)
+            try:
+                for name, srcname, pkginfo in packages:
+                    if shard is not None and shard_of(name, shards) != shard:
+                        continue
+                    names.add(name)
+                    db.add_document(self.make_document(name, srcname, pkginfo, stem_stats))
+            except UnsortedInput:
+                # Release the database lock before starting again
+                del db
+                raise
+            return db
+        db = self.each_package(build)
+        return db, len(names), stem_stats
+
+    def index_sharded(self, shards):
+        """
+        Rebuild the Xapian index splitting the packages in shards, each
+        indexed by its own worker process, then merging them in a compacted
+        database that replaces the current one atomically
+        """
+        log.info("%s: indexing data in %d shards", self.name, shards)
+        start = time.time()
+        stamp = self.input_stamp()
+        fingerprint = self.input_fingerprint()
+
+        workdir = tempfile.mkdtemp(prefix="db.build-", dir=self.root)
+        try:
+            paths = [os.path.join(workdir, "shard%d" % i) for i in range(shards)]
+            results = parallel.index_shards(self, paths)
+            count = 0
+            stem_stats = dict([(x, 0) for x in self.stemmers])
+            for shard_count, shard_stats in results:
+                count += shard_count
+                for k, v in shard_stats.iteritems():
+                    stem_stats[k] += v
+            for k, v in sorted(stem_stats.iteritems(), key=lambda x:x[0]):
+                log.info("%s: stemmer %s matched %d names", self.name, k, v)
+            built = time.time()
+
+            generation = self.new_generation()
+            dest = os.path.join(self.root, "db." + generation)
+            try:
+                compact_databases(paths, dest)
+            except:
+                if os.path.exists(dest):
+                    shutil.rmtree(dest)
+                raise
+        finally:
+            shutil.rmtree(workdir)
+        compacted = time.time()
+
+        try:
+            db = xapian.WritableDatabase(dest, xapian.DB_CREATE_OR_OPEN)
+            db.set_metadata("inputs", fingerprint)
+            db.set_metadata("style", self.style)
+            db.set_metadata("inputs_stamp", stamp)
+            db.set_metadata("generation", generation)
+            self.store_counts(db, count)
+            db.flush()
+        except:
+            shutil.rmtree(dest)
+            raise
+        self.swap_db(dest)
+        self.write_name_table(db)
+        log.info("%s: index built in %.1fs (%.1fs indexing, %.1fs compacting), %d bytes",
+                 self.name, time.time() - start, built - start, compacted - built,
+                 disk_usage(self.dbpath))
+
+    def swap_db(self, path):
+        """
+        Make the database directory path, in the distro directory, the index
+        of this distro.
+
+        The index is then a symlink to path, so that it can be replaced with
+        a single rename. An index that is not already a symlink is moved
+        aside first, so it briefly goes missing.
+        """
+        tmplink = os.path.join(self.root, "db.link-%d" % os.getpid())
+        os.symlink(os.path.basename(path), tmplink)
+        old = None
+        if os.path.islink(self.dbpath):
+            old = os.path.join(self.root, os.readlink(self.dbpath))
+        elif os.path.exists(self.dbpath):
+            old = os.path.join(self.root, "db.old-%d" % os.getpid())
+            os.rename(self.dbpath, old)
+        os.rename(tmplink, self.dbpath)
+        if old is not None and os.path.abspath(old) != os.path.abspath(path):
+            shutil.rmtree(old)
+        # Drop a database opened before the swap, and what was read from it
+        self.__dict__.pop("db", None)
+        self.__dict__.pop("postings", None)
+
+    def copy_db(self):
+        """
+        Copy the current index to a new directory in the distro directory,
+        to be changed and then swapped in with swap_db.
+
+        Returns the path of the copy and the copy opened for writing.
+        """
+        src = os.path.realpath(self.dbpath)
+        dest = os.path.join(self.root, "db." + uuid.uuid4().hex)
+        start = time.time()
+        # On filesystems that support it, a reflink copy shares the data
+        # blocks until they are changed, and takes constant time
+        with open(os.devnull, "w") as devnull:
+            try:
+                res = subprocess.call(["cp", "-a", "--reflink=auto", src, dest], stderr=devnull)
+            except OSError:
+                res = 1
+        if res != 0:
+            if os.path.exists(dest):
+                shutil.rmtree(dest)
+            shutil.copytree(src, dest)
+        log.info("%s: index copied in %.1fs", self.name, time.time() - start)
+        try:
+            return dest, xapian.WritableDatabase(dest, xapian.DB_OPEN)
+        except:
+            shutil.rmtree(dest)
+            raise
+
+    def update(self, db):
+        """
+        Update the index, changing only the documents of the packages that
+        were added, removed or changed in the input files.
+
+        db is the current index, which is read to find the changes, and then
+        replaced with an updated copy.
+        """
+        stamp = self.input_stamp()
+        if db.get_metadata("inputs_stamp") == stamp:
+            log.info("%s: input files unchanged, index is up to date", self.name)
+            if not os.path.exists(self.name_table_path):
+                self.write_name_table(db)
+            return
+        fingerprint = self.input_fingerprint()
+        if db.get_metadata("inputs") == fingerprint:
+            # The new stamp is not stored, as it is not worth copying the
+            # index: the fingerprint is computed again next time
+            log.info("%s: input data unchanged, index is up to date", self.name)
+            if not os.path.exists(self.name_table_path):
+                self.write_name_table(db)
+            return
+
+        log.info("%s: updating index", self.name)
+
+        # Digests of the documents in the index, grouped by name term
+        old = dict()
+        for p in db.postlist(""):
+            doc = db.get_document(p.docid)
+            term = "XP" + doc.get_data().lower()
+            old.setdefault(term, []).append(doc.get_value(VALUE_DIGEST))
+
+        # Digests of the documents to index, grouped by name term, and the new
+        # documents whose digest is not in the index
+        new = dict()
+        new_docs = dict()
+        names = set()
+        def scan(packages):
+            new.clear()
+            new_docs.clear()
+            names.clear()
+            stem_stats = dict([(x, 0) for x in self.stemmers])
+            for name, srcname, pkginfo in packages:
+                names.add(name)
+                doc = self.make_document(name, srcname, pkginfo, stem_stats)
+                term = "XP" + name.lower()
+                digest = doc.get_value(VALUE_DIGEST)
+                new.setdefault(term, []).append(digest)
+                if digest not in old.get(term, ()):
+                    new_docs.setdefault(term, []).append(doc)
+        self.each_package(scan)
+
+        # Packages whose document set changed
+        changed = set()
+        for term, digests in new.iteritems():
+            if sorted(digests) != sorted(old.get(term, [])):
+                changed.add(term)
+        removed = set(old.iterkeys()) - set(new.iterkeys())
+
+        # If only some of the documents of a changed package are new, we need
+        # another pass to fetch the rest
+        incomplete = set([t for t in changed if len(new_docs.get(t, ())) != len(new[t])])
+        if incomplete:
+            new_docs.clear()
+            def fetch(packages):
+                stem_stats = dict([(x, 0) for x in self.stemmers])
+                for name, srcname, pkginfo in packages:
+                    term = "XP" + name.lower()
+                    if term not in changed: continue
+                    doc = self.make_document(name, srcname, pkginfo, stem_stats)
+                    new_docs.setdefault(term, []).append(doc)
+            self.each_package(fetch)
+
+        path, db = self.copy_db()
+        try:
+            count_added = count_changed = count_removed = 0
+            for term in changed:
+                docs = new_docs[term]
+                digests = old.get(term, None)
+                if digests is None:
+                    count_added += 1
+                else:
+                    count_changed += 1
+                    if len(digests) == 1 and len(docs) == 1:
+                        db.replace_document(term, docs[0])
+                        continue
+                    db.delete_document(term)
+                for doc in docs:
+                    db.add_document(doc)
+            for term in removed:
+                count_removed += 1
+                db.delete_document(term)
+
+            log.info("%s: %d packages added, %d changed, %d removed",
+                     self.name, count_added, count_changed, count_removed)
+
+            db.set_metadata("inputs", fingerprint)
+            db.set_metadata("style", self.style)
+            db.set_metadata("inputs_stamp", stamp)
+            db.set_metadata("generation", self.new_generation())
+            self.store_counts(db, len(names))
+            db.flush()
+        except:
+            shutil.rmtree(path)
+            raise
+        self.swap_db(path)
+        self.write_name_table(db)
+
+    def write_name_table(self, db):
+        "Write the name to docid table for the flushed database db"
+        nametable.write_for_db(self.name_table_path, db, db.get_metadata("generation"))
+        # Drop a table opened before reindexing
+        self.__dict__.pop("name_table", None)
+
+    def new_generation(self):
+        "Create a new, unique generation stamp for the index"
+        return uuid.uuid4().hex
+
+    def generation(self):
+        """
+        Return the generation stamp of the index, which changes every time
+        its contents change, or None if the index does not have one
+        """
+        return self.db.get_metadata("generation") or None
+
+    def count_terms(self, db):
+        "Count the terms of each kind of CONTENT_INFO in db"
         def count_pfx(pfx):
             count = 0
-            for t in self.db.allterms(v.pfx):
+            for t in db.allterms(pfx):
                 count += 1
             return count
-        info = [(k, count_pfx(v.pfx)) for k, v in CONTENT_INFO.iteritems()]
+        return [(k, count_pfx(v.pfx)) for k, v in CONTENT_INFO.iteritems()]
+
+    def store_counts(self, db, count_packages):
+        """
+        Store the number of packages and the term counts as metadata in the
+        writable database db, so that stats does not need to compute them
+        """
+        db.set_metadata("count_packages", str(count_packages))
+        db.set_metadata("count_terms", " ".join(
+            "%s:%d" % (k, c) for k, c in self.count_terms(db)))
+
+    def counts(self):
+        """
+        Return the number of packages and a list of (kind, count) with the
+        number of terms of each kind of CONTENT_INFO.
+
+        The values stored at index time are used if available.
+        """
+        count_packages = self.db.get_metadata("count_packages")
+        count_terms = self.db.get_metadata("count_terms")
+        if not count_packages or not count_terms:
+            return len(self.package_names), self.count_terms(self.db)
+        info = []
+        for item in count_terms.split():
+            k, c = item.rsplit(":", 1)
+            info.append((k, int(c)))
+        return int(count_packages), info
+
+    def stats(self, out=sys.stderr):
+        "Print stats about the contents of this distro"
+        count_packages, info = self.counts()
+        print >>out, "%s: %d packages" % (self.name, count_packages)
         print >>out, "%s: %s files" % (self.name, ", ".join(["%d %s" % (c, n) for n, c in info]))
 
     def document_for(self, name):
         "Retrieve the Xapian document given the binary package name"
+        if self.name_table is not None:
+            docid = self.name_table.lookup(name.lower())
+            if docid is None:
+                return None
+            if docid != nametable.AMBIGUOUS:
+                return self.db.get_document(docid)
+        return self.query_document(name)
+
+    def query_document(self, name):
+        """
+        Retrieve the Xapian document given the binary package name, running
+        a query on the index
+        """
         enq = xapian.Enquire(self.db)
         enq.set_query(xapian.Query("XP"+name.lower()))
         mset = enq.get_mset(0, 1)
@@ -215,24 +845,110 @@ class Distro(object):
                 print >>out, "\t%s" % term
 
 class Distros(object):
-    def __init__(self, reindex=False, root="."):
+    def __init__(self, reindex=False, root=".", jobs=1, incremental=False, shards=1):
+        """
+        Access all the distributions found in root.
+
+        If reindex is True, rebuild all the indices, or only update them with
+        the changes in their input files if incremental is True. Missing
+        indices are always rebuilt. If jobs is more than 1, indices are
+        rebuilt in parallel by up to that number of worker processes. If
+        shards is more than 1, indices are rebuilt with Distro.index_sharded.
+        """
         # Definition of all the distros we know
         self.distros = []
-        for d in os.listdir(root):
+        names = []
+        for d in sorted(os.listdir(root)):
             if not d.startswith("dist-"): continue
-            name = d[5:]
+            names.append(d[5:])
+
+        if jobs > 1:
+            names = self.reindex_parallel(names, reindex, root, jobs, incremental, shards)
+            reindex = False
+
+        for name in names:
+            d = "dist-" + name
             try:
-                self.distros.append(Distro(name, reindex=reindex, root=root))
+                distro = Distro(name, reindex=reindex, root=root, incremental=incremental, shards=shards)
             except Exception, e:
                 log.info("cannot access distribution in %s: %s. skipping %s", d, str(e), name)
+                continue
+            # Open the existing indices now, to skip those that cannot be
+            # opened; missing ones are built when first used
+            if os.path.exists(distro.dbpath):
+                try:
+                    distro.db
+                except Exception, e:
+                    log.warning("cannot open index in %s: %s. skipping %s", d, str(e), name)
+                    continue
+            self.distros.append(distro)
         self.distro_map = dict([(x.name, x) for x in self.distros])
 
-    def make_matcher(self, start):
+    def reindex_parallel(self, names, reindex, root, jobs, incremental=False, shards=1):
+        """
+        Reindex the distributions that need it, using up to jobs worker
+        processes.
+
+        Returns the names of the distributions that can be used afterwards.
+        """
+        todo = []
+        for name in names:
+            try:
+                Distro.read_style(name, root)
+            except Exception:
+                # Leave it to the normal constructor to report and skip it
+                continue
+            if reindex or not os.path.exists(os.path.join(root, "dist-" + name, "db")):
+                todo.append(name)
+
+        failed = parallel.reindex_parallel(todo, root, jobs, incremental, shards)
+        for name, error in sorted(failed.iteritems()):
+            log.error("%s: reindex failed, skipping distribution: %s", name, error)
+        return [x for x in names if x not in failed]
+
+    def make_matcher(self, start, bulk=False, cachedir=None, tabledir=None, fused=False, budget=None, profile=None):
+        """
+        Create a Matcher from the distribution start to all the others.
+
+        If bulk is True, create a BulkMatcher, which is faster when matching
+        all the packages of the distribution. Otherwise, if fused is True,
+        create a FusedMatcher, which runs fewer queries per package.
+
+        If cachedir is given, keep a persistent cache of the match results
+        in it. If tabledir is given, read the matches from the precomputed
+        match table in it, if it is up to date.
+
+        If budget is a QueryBudget, it limits the cost of the fuzzy queries.
+        Cache and tables hold the results computed without limits, so they
+        are not used in that case.
+
+        If profile is a MatchProfile, the matcher records timings and query
+        statistics in it. Cache and tables would hide the cost of the match
+        methods, so they are not used in that case either.
+        """
         # Pick the start distribution
         pivot = self.distro_map.get(start, None)
         if pivot is None:
             log.error("Distribution %s not found", start)
             return None
 
+        if budget is not None or profile is not None:
+            cachedir = tabledir = None
+
+        if cachedir is not None:
+            cache = matchcache.MatchCache.for_pivot(cachedir, start)
+        else:
+            cache = None
+
+        if tabledir is not None:
+            table = matchtable.open_table(tabledir, start,
+                    dict([(d.name, d.generation()) for d in self.distros]))
+        else:
+            table = None
+
         # Instantiate the matcher engine
-        return matcher.Matcher(self.distros, pivot)
+        if bulk:
+            return matcher.BulkMatcher(self.distros, pivot, cache=cache, table=table, budget=budget, profile=profile)
+        if fused:
+            return matcher.FusedMatcher(self.distros, pivot, cache=cache, table=table, budget=budget, profile=profile)
+        return matcher.Matcher(self.distros, pivot, cache=cache, table=table, budget=budget, profile=profile)
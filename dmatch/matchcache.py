@@ -0,0 +1,173 @@
+# distromatch - Match binary package names across distributions
+#
+# Copyright (C) 2011  Enrico Zini <enrico@enricozini.org>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import os
+import os.path
+import anydbm
+import whichdb
+import fcntl
+import uuid
+import marshal
+import logging
+from collections import OrderedDict
+
+log = logging.getLogger(__name__)
+
+def open_reader(fname):
+    """
+    Open the dbm file fname read only. gdbm readers would lock out writers
+    in other processes, so gdbm files are opened without locking:
+    MatchCache does its own.
+    """
+    if whichdb.whichdb(fname) == "gdbm":
+        import gdbm
+        return gdbm.open(fname, "ru")
+    return anydbm.open(fname, "r")
+
+def cache_key(name):
+    "Return the dbm key for a package name, which can be unicode"
+    if isinstance(name, unicode):
+        return name.encode("utf-8")
+    return name
+
+class MatchCache(object):
+    """
+    Persistent cache of match results for one pivot distribution, with the
+    most recently used entries also kept in memory.
+
+    Entries are stored by package name, and are opaque to the cache:
+    Matcher stores the index generations they were computed from, and
+    ignores the entries whose distributions have been reindexed since.
+
+    Several processes can use the same cache file: reads and writes happen
+    under a lock on a separate lock file, and new entries are written in
+    batches. Each write stores a new token in the lock file, so that
+    readers know when to reopen the file.
+    """
+    def __init__(self, fname, lru_size=10000, sync_every=1000):
+        self.fname = fname
+        self.lockfd = os.open(fname + ".lock", os.O_RDWR | os.O_CREAT, 0666)
+        # Read only handle, and the token of the write it was opened after
+        self.db = None
+        self.db_token = None
+        self.lru = OrderedDict()
+        self.lru_size = lru_size
+        # Serialised entries not yet written to disk
+        self.pending = dict()
+        # Number of writes between flushes to disk
+        self.sync_every = sync_every
+        self.hits = 0
+        self.misses = 0
+
+    @classmethod
+    def for_pivot(cls, cachedir, pivot, **kw):
+        "Open the cache for the given pivot distribution name in cachedir"
+        if not os.path.isdir(cachedir):
+            os.makedirs(cachedir)
+        return cls(os.path.join(cachedir, "match-" + pivot), **kw)
+
+    def remember(self, key, entry):
+        "Add an entry to the in-memory LRU"
+        self.lru[key] = entry
+        if len(self.lru) > self.lru_size:
+            self.lru.popitem(last=False)
+
+    def token(self):
+        "Return the token stored by the last write to the file"
+        os.lseek(self.lockfd, 0, os.SEEK_SET)
+        return os.read(self.lockfd, 64)
+
+    def close_reader(self):
+        if self.db is not None:
+            self.db.close()
+            self.db = None
+        self.db_token = None
+
+    def read(self, key):
+        "Read the serialised entry for key from disk, or None if missing"
+        fcntl.flock(self.lockfd, fcntl.LOCK_SH)
+        try:
+            token = self.token()
+            if token != self.db_token:
+                # Written since we opened it, or not opened yet
+                self.close_reader()
+                try:
+                    self.db = open_reader(self.fname)
+                except anydbm.error:
+                    # The file has not been created yet
+                    pass
+                self.db_token = token
+            if self.db is None:
+                return None
+            try:
+                return self.db[key]
+            except KeyError:
+                return None
+        finally:
+            fcntl.flock(self.lockfd, fcntl.LOCK_UN)
+
+    def get(self, name):
+        "Return the entry for name, or None if it is not in the cache"
+        key = cache_key(name)
+        entry = self.lru.pop(key, None)
+        if entry is None:
+            data = self.pending.get(key, None)
+            if data is None:
+                data = self.read(key)
+            if data is None:
+                self.misses += 1
+                return None
+            entry = marshal.loads(data)
+        self.hits += 1
+        self.remember(key, entry)
+        return entry
+
+    def put(self, name, entry):
+        "Store the entry for name"
+        key = cache_key(name)
+        self.pending[key] = marshal.dumps(entry)
+        self.lru.pop(key, None)
+        self.remember(key, entry)
+        if len(self.pending) >= self.sync_every:
+            self.sync()
+
+    def sync(self):
+        "Write the pending entries to disk"
+        if not self.pending:
+            return
+        fcntl.flock(self.lockfd, fcntl.LOCK_EX)
+        try:
+            self.close_reader()
+            db = anydbm.open(self.fname, "c")
+            try:
+                for key, data in self.pending.iteritems():
+                    db[key] = data
+            finally:
+                db.close()
+            os.ftruncate(self.lockfd, 0)
+            os.lseek(self.lockfd, 0, os.SEEK_SET)
+            os.write(self.lockfd, uuid.uuid4().hex)
+        finally:
+            fcntl.flock(self.lockfd, fcntl.LOCK_UN)
+        self.pending.clear()
+
+    def close(self):
+        self.sync()
+        log.info("%s: %d hits, %d misses", self.fname, self.hits, self.misses)
+        self.close_reader()
+        os.close(self.lockfd)
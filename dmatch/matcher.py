@@ -20,16 +20,146 @@ import sys
 import xapian
 import os
 import os.path
+import time
+import heapq
 from gzip import GzipFile
 import logging
 from rules import *
 
 log = logging.getLogger(__name__)
 
+class QueryBudget(object):
+    """
+    Limits on the cost of a term based query.
+
+    Terms are taken in order of selectivity (fewest documents first) from
+    the target database. Terms in more than max_df (a fraction) of the
+    documents are skipped as too common, and at most max_terms terms are
+    used, stopping before the total postings go over max_postings. The
+    most selective term is always kept. Any limit can be None.
+    """
+    def __init__(self, max_terms=None, max_postings=None, max_df=None):
+        self.max_terms = max_terms
+        self.max_postings = max_postings
+        self.max_df = max_df
+
+    def __str__(self):
+        return "max_terms=%s max_postings=%s max_df=%s" % (self.max_terms, self.max_postings, self.max_df)
+
+    def select(self, terms, db):
+        "Return the list of terms to query in db"
+        if self.max_df is not None:
+            max_freq = self.max_df * db.get_doccount()
+        else:
+            max_freq = None
+        freqs = []
+        for t in set(terms):
+            freq = db.get_termfreq(t)
+            # Terms that are not in db cannot change the results
+            if freq == 0: continue
+            freqs.append((freq, t))
+        freqs.sort()
+        if max_freq is not None:
+            freqs = freqs[:1] + [x for x in freqs[1:] if x[0] <= max_freq]
+        if self.max_terms is not None:
+            freqs = freqs[:max(self.max_terms, 1)]
+        res = []
+        postings = 0
+        for freq, t in freqs:
+            postings += freq
+            if res and self.max_postings is not None and postings > self.max_postings:
+                break
+            res.append(t)
+        return res
+
+class MatchProfile(object):
+    """
+    Timings and query statistics of a Matcher, for each match method and
+    target distro, plus the slowest packages.
+
+    If hook is given, it is called as hook(name, seconds, calls) after each
+    package is matched, where calls is a list of (method name, distro name,
+    seconds) for that package.
+    """
+    FIELDS = ("calls", "seconds", "queries", "terms", "mset_size", "estimated_matches", "cached_queries")
+
+    def __init__(self, top=20, hook=None):
+        self.top = top
+        self.hook = hook
+        # (method name, distro name) -> list of values for FIELDS
+        self.stats = dict()
+        # Heap with (seconds, name) of the slowest packages
+        self.slowest = []
+        self.count = 0
+        self.seconds = 0.0
+        self.calls = []
+
+    def entry(self, meth, distro):
+        res = self.stats.get((meth, distro), None)
+        if res is None:
+            res = self.stats[(meth, distro)] = [0, 0.0, 0, 0, 0, 0, 0]
+        return res
+
+    def record_call(self, meth, distro, seconds):
+        "Record the time spent running a method on a target distro"
+        entry = self.entry(meth, distro)
+        entry[0] += 1
+        entry[1] += seconds
+        self.calls.append((meth, distro, seconds))
+
+    def record_query(self, meth, distro, terms, mset_size, estimated, cached=False):
+        """
+        Record a query run by a method on a target distro, with the number of
+        its terms, of the documents returned, and Xapian's estimate of the
+        matching documents.
+
+        cached is True for queries answered from the posting cache instead
+        of Xapian: they are also counted as queries.
+        """
+        entry = self.entry(meth, distro)
+        entry[2] += 1
+        entry[3] += terms
+        entry[4] += mset_size
+        entry[5] += estimated
+        if cached:
+            entry[6] += 1
+
+    def record_package(self, name, seconds):
+        "Record the time spent matching a package"
+        self.count += 1
+        self.seconds += seconds
+        if len(self.slowest) < self.top:
+            heapq.heappush(self.slowest, (seconds, name))
+        elif self.top and seconds > self.slowest[0][0]:
+            heapq.heapreplace(self.slowest, (seconds, name))
+        if self.hook is not None:
+            self.hook(name, seconds, self.calls)
+        self.calls = []
+
+    def as_dict(self):
+        "Return the profile data as a dict that can be serialised as JSON"
+        methods = []
+        for (meth, distro), values in self.stats.iteritems():
+            info = dict(zip(self.FIELDS, values))
+            info["method"] = meth
+            info["distro"] = distro
+            methods.append(info)
+        methods.sort(key=lambda x: (-x["seconds"], x["method"], x["distro"]))
+        return dict(
+            packages=self.count,
+            seconds=self.seconds,
+            methods=methods,
+            slowest=[dict(package=name, seconds=seconds) for seconds, name in sorted(self.slowest, reverse=True)])
+
 class Method(object):
     """
     Implementation of one match method
     """
+    # QueryBudget for the queries of this method, or None for no limits
+    budget = None
+    # MatchProfile recording the queries of this method, or None
+    profile = None
+
     def prepare(self, name, d_from):
         """
         Prepare a query to match a name from d_from to multiple distros.
@@ -48,6 +178,57 @@ class Method(object):
         """
         return []
 
+    def bulk_match(self, name, d_from, d_to, tables):
+        """
+        Same as match, but use the term postings preloaded in tables (a
+        TermTables object) instead of querying Xapian, where possible
+        """
+        return self.match(name, d_from, d_to, self.prepare(name, d_from))
+
+    def query(self, d_to, terms):
+        """
+        Run an OR query with terms on d_to, returning the package names of
+        the best mset_size results.
+
+        When all the matching documents fit in the results, the names are
+        the union of the postings of the terms, taken from the posting cache
+        of d_to.
+        """
+        if sum([d_to.db.get_termfreq(t) for t in terms]) <= self.mset_size:
+            names = set()
+            for t in terms:
+                names.update(d_to.term_packages(t))
+            if self.profile is not None:
+                self.profile.record_query(self.name, d_to.name, len(terms), len(names), len(names), cached=True)
+            return list(names)
+        enq = xapian.Enquire(d_to.db)
+        enq.set_query(xapian.Query(xapian.Query.OP_OR, terms))
+        mset = enq.get_mset(0, self.mset_size)
+        if self.profile is not None:
+            self.profile.record_query(self.name, d_to.name, len(terms), len(mset), mset.get_matches_estimated())
+        names = []
+        for m in mset:
+            names.append(m.document.get_data())
+        return names
+
+    def query_terms(self, terms, d_to):
+        "Return the terms to query in d_to, selected by the budget if any"
+        if self.budget is None:
+            return terms
+        return self.budget.select(terms, d_to.db)
+
+    def names_for_hits(self, name, d_from, d_to, prepared, hits, tables):
+        """
+        Turn the set of docids hit by a joined query into the list of package
+        names that match would return.
+
+        When there are more hits than match would return, the result would
+        depend on Xapian's ranking, so we fall back to running the real query.
+        """
+        if len(hits) > self.mset_size:
+            return self.match(name, d_from, d_to, prepared)
+        return [tables.doc_name(d_to, docid) for docid in hits]
+
 class ByName(Method):
     """
     Match packages if the name is the same
@@ -55,8 +236,12 @@ class ByName(Method):
     name = "byname"
 
     def match(self, name, d_from, d_to, prepared=None):
-        doc = d_to.document_for(name)
-        if doc is not None:
+        if d_to.has_package(name):
+            return [name]
+        return []
+
+    def bulk_match(self, name, d_from, d_to, tables):
+        if tables.docids(d_to, "XP", "XP" + name.lower()):
             return [name]
         return []
 
@@ -67,6 +252,8 @@ class ByStemmer(Method):
     """
     Match packages by stemming their names
     """
+    mset_size = 10
+
     def __init__(self, pfx):
         self.name = "stem_" + pfx
         self.pfx = pfx
@@ -82,18 +269,21 @@ class ByStemmer(Method):
             stemmed = self.prepare(name, d_from)
 
         # Query the stemmed form in each distro
-        enq = xapian.Enquire(d_to.db)
-        enq.set_query(xapian.Query(xapian.Query.OP_OR, stemmed))
-        mset = enq.get_mset(0, 10)
-        names = []
-        for m in mset:
-            names.append(m.document.get_data())
-        return names
+        return self.query(d_to, self.query_terms(stemmed, d_to))
+
+    def bulk_match(self, name, d_from, d_to, tables):
+        stemmed = self.query_terms(self.prepare(name, d_from), d_to)
+        hits = set()
+        for t in stemmed:
+            hits.update(tables.docids(d_to, self.pfx, t))
+        return self.names_for_hits(name, d_from, d_to, stemmed, hits, tables)
 
 class ByContents(Method):
     """
     Match packages by content
     """
+    mset_size = 20
+
     def __init__(self, kind):
         """
         Kind is the kind of content file that is matched
@@ -123,13 +313,23 @@ class ByContents(Method):
             files = self.prepare(name, d_from)
 
         # Query each distro for what packages have those files
-        enq = xapian.Enquire(d_to.db)
-        enq.set_query(xapian.Query(xapian.Query.OP_OR, files))
-        mset = enq.get_mset(0, 20)
-        names = []
-        for m in mset:
-            names.append(m.document.get_data())
-        return names
+        return self.query(d_to, self.query_terms(files, d_to))
+
+    def bulk_prepare(self, name, d_from, tables):
+        pfx = CONTENT_INFO[self.kind].pfx
+        docids = tables.docids(d_from, "XP", "XP" + name.lower())
+        if len(docids) != 1:
+            # Missing or ambiguous package name: let document_for decide
+            return self.prepare(name, d_from)
+        return tables.doc_terms(d_from, pfx).get(docids[0], [])
+
+    def bulk_match(self, name, d_from, d_to, tables):
+        pfx = CONTENT_INFO[self.kind].pfx
+        files = self.query_terms(self.bulk_prepare(name, d_from, tables), d_to)
+        hits = set()
+        for t in files:
+            hits.update(tables.docids(d_to, pfx, t))
+        return self.names_for_hits(name, d_from, d_to, files, hits, tables)
 
 
 # TODO:
@@ -139,13 +339,24 @@ class ByContents(Method):
 #    methods to match source packages
 
 class Matcher(object):
-    "Match packages across distros"
-    def __init__(self, distros, pivot):
+    """
+    Match packages across distros.
+
+    If cache is a MatchCache, match results are stored in it and reused
+    as long as the indices they were computed from are not rebuilt. If table
+    is a MatchTable, results are read from it for the packages it contains.
+    If budget is a QueryBudget, it limits the queries of the fuzzy content
+    methods and of the stemmers. If profile is a MatchProfile, timings and
+    query statistics are recorded in it.
+    """
+    def __init__(self, distros, pivot, cache=None, table=None, budget=None, profile=None):
         self.distros = [d for d in distros if d is not pivot]
         self.pivot = pivot
-        self.count_all = 0
-        self.count_matchcounts = dict([(x, 0) for x in range(len(self.distros)+1)])
-        self.counts = dict()
+        self.cache = cache
+        self.table = table
+        if cache is not None:
+            # Index generations at the time the matcher was created
+            self.generations = dict([(d.name, d.generation()) for d in distros])
         self.methods = []
         self.methods.append(ByName())
         self.methods.append(ByContents("desktop"))
@@ -160,59 +371,340 @@ class Matcher(object):
         self.fuzzy_methods.append(ByContents("devlib"))
         self.fuzzy_methods.append(ByContents("man"))
         self.fuzzy_methods.append(ByContents("py"))
-
+        self.budget = budget
+        if budget is not None:
+            for meth in [m for m in self.methods if isinstance(m, ByStemmer)] + self.fuzzy_methods:
+                meth.budget = budget
+        self.profile = profile
+        if profile is not None:
+            for meth in self.methods + self.fuzzy_methods:
+                meth.profile = profile
+        self.reset_counts()
+
+    def reset_counts(self):
+        "Reset the match statistics"
+        self.count_all = 0
+        self.count_matchcounts = dict([(x, 0) for x in range(len(self.distros)+1)])
+        self.counts = dict()
         for meth in self.methods + self.fuzzy_methods:
             self.counts[meth.name] = 0
 
+    def get_counts(self):
+        "Return the match statistics in a form that can be passed to add_counts"
+        return self.count_all, self.counts, self.count_matchcounts
+
+    def add_counts(self, counts):
+        """
+        Add to our statistics those returned by get_counts on another Matcher
+        with the same pivot
+        """
+        count_all, counts, count_matchcounts = counts
+        self.count_all += count_all
+        for k, v in counts.iteritems():
+            self.counts[k] += v
+        for k, v in count_matchcounts.iteritems():
+            self.count_matchcounts[k] += v
+
     def stats(self, out=sys.stderr):
         "Print stats for all available distributions"
         self.pivot.stats(out)
         for d in self.distros:
             d.stats(out)
 
-    def do_method(self, name, meth, res):
-        found = False
-        for d in self.distros:
-            data = meth.prepare(name, self.pivot)
-            matches = meth.match(name, self.pivot, d, data)
-            if matches:
-                found = True
-                res.setdefault(d.name, set()).update(matches)
-        if found:
-            self.counts[meth.name] += 1
-        return found
+    def match_method(self, name, meth, d):
+        "Run the match method meth for name, from the pivot to d"
+        data = meth.prepare(name, self.pivot)
+        return meth.match(name, self.pivot, d, data)
 
-    def match(self, name):
-        "If some match is possible, return a dict(distro=set(names))"
-        self.count_all += 1
+    def match_distros(self, name, distros):
+        """
+        Run all the match methods for name, from the pivot to each of distros.
 
+        Returns a dict(distro=(set(names), set(method names))) with the
+        matches found in each distro, and the methods that found them.
+        """
         res = dict()
-        found = False
-
-        # Try with exact methods
-        for meth in self.methods:
-            if self.do_method(name, meth, res):
-                found = True;
+        profile = self.profile
+        for meth in self.methods + self.fuzzy_methods:
+            for d in distros:
+                if profile is None:
+                    matches = self.match_method(name, meth, d)
+                else:
+                    start = time.time()
+                    matches = self.match_method(name, meth, d)
+                    profile.record_call(meth.name, d.name, time.time() - start)
+                if matches:
+                    names, meths = res.setdefault(d.name, (set(), set()))
+                    names.update(matches)
+                    meths.add(meth.name)
+        return res
 
-        # Try with fuzzy methods
-        for meth in self.fuzzy_methods:
-            if self.do_method(name, meth, res):
-                found = True
+    def account(self, found):
+        """
+        Update the match statistics with the result of match_distros, and
+        turn it into the result of match
+        """
+        self.count_all += 1
 
         if not found:
-            if 0:
-                print "Not matched:", name
             self.count_matchcounts[0] += 1
             return None
 
-        self.count_matchcounts[len(res)] += 1
+        for meth in self.methods + self.fuzzy_methods:
+            for names, meths in found.itervalues():
+                if meth.name in meths:
+                    self.counts[meth.name] += 1
+                    break
+
+        self.count_matchcounts[len(found)] += 1
+        return dict([(k, names) for k, (names, meths) in found.iteritems()])
+
+    def match(self, name):
+        "If some match is possible, return a dict(distro=set(names))"
+        if self.profile is None:
+            return self.match_package(name)
+        start = time.time()
+        res = self.match_package(name)
+        self.profile.record_package(name, time.time() - start)
         return res
 
+    def match_package(self, name):
+        "Implementation of match, using the match table and cache if any"
+        if self.table is not None:
+            row = self.table.lookup(name)
+            if row is not None:
+                meths, matches = self.table.matches(row)
+                meths = set(meths)
+                return self.account(dict([(k, (v, meths)) for k, v in matches.iteritems()]))
+
+        if self.cache is None:
+            return self.account(self.match_distros(name, self.distros))
+
+        # Reuse the cached matches for the distros whose index did not change
+        found = dict()
+        stale = []
+        entry = self.cache.get(name)
+        if entry is not None and entry[0] is not None and entry[0] == self.generations[self.pivot.name]:
+            targets = entry[1]
+            for d in self.distros:
+                cached = targets.get(d.name, None)
+                if cached is None or cached[0] is None or cached[0] != self.generations[d.name]:
+                    stale.append(d)
+                elif cached[1]:
+                    found[d.name] = (set(cached[1]), set(cached[2]))
+        else:
+            targets = dict()
+            stale = self.distros
+
+        if stale:
+            computed = self.match_distros(name, stale)
+            targets = dict(targets)
+            for d in stale:
+                names, meths = computed.get(d.name, ((), ()))
+                targets[d.name] = (self.generations[d.name], sorted(names), sorted(meths))
+                if names:
+                    found[d.name] = (set(names), set(meths))
+            self.cache.put(name, (self.generations[self.pivot.name], targets))
+
+        return self.account(found)
+
+    def close(self):
+        "Save and close the match cache and table, if any"
+        if self.cache is not None:
+            self.cache.close()
+            self.cache = None
+        if self.table is not None:
+            self.table.close()
+            self.table = None
+
     def match_stats(self, out=sys.stderr):
         "Print statistics about the matching operations so far"
         print >>out, "%d packages tested" % self.count_all
         print >>out, "Founds by method:"
-        for meth in self.methods:
+        for meth in self.methods + self.fuzzy_methods:
             print >>out, "%d matched by %s" % (self.counts[meth.name], meth.get_doc())
+        for d in self.distros:
+            if "postings" not in d.__dict__: continue
+            print >>out, "%s: %d posting cache hits, %d misses" % (d.name, d.postings.hits, d.postings.misses)
         for i in range(len(self.distros)+1):
             print >>out, "%d matched %d distro%s" % (self.count_matchcounts[i], i, 's' if i != 1 else '')
+
+
+class FusedMatcher(Matcher):
+    """
+    Matcher that runs one combined query per target distro for all the
+    term based match methods.
+
+    The pivot document is read once, and the hits of the combined query are
+    attributed back to the methods through their matching terms. A method
+    whose terms could match more documents than its query returns would
+    have a result depending on ranking, and runs its own query instead.
+    Results are the same as Matcher's.
+    """
+    def prepare_all(self, name):
+        "Return a list of (method, prepared data) for all the match methods"
+        meths = self.methods + self.fuzzy_methods
+        content = [m for m in meths if isinstance(m, ByContents)]
+        files = dict([(m.name, []) for m in content])
+        if content:
+            doc = self.pivot.document_for(name)
+            if doc is None:
+                raise KeyError("Package %s not found in %s" % (name, self.pivot.name))
+            # Walk the termlist once, with the same prefix test as
+            # ByContents.prepare
+            prefixes = [(CONTENT_INFO[m.kind].pfx, files[m.name]) for m in content]
+            for t in doc.termlist():
+                term = t.term
+                for pfx, terms in prefixes:
+                    if term.startswith(pfx):
+                        terms.append(term)
+        res = []
+        for meth in meths:
+            if isinstance(meth, ByContents):
+                res.append((meth, files[meth.name]))
+            else:
+                res.append((meth, meth.prepare(name, self.pivot)))
+        return res
+
+    def match_target(self, name, prepared, d):
+        """
+        Return a dict(method name=matches) for name, from the pivot to d.
+
+        With a profile, the combined query is recorded as the "fused" method.
+        """
+        res = dict()
+        fused = []
+        profile = self.profile
+        for meth, data in prepared:
+            if isinstance(meth, (ByContents, ByStemmer)):
+                terms = set(meth.query_terms(data, d))
+                if sum([d.db.get_termfreq(t) for t in terms]) <= meth.mset_size:
+                    fused.append((meth, terms))
+                    continue
+            if profile is None:
+                matches = meth.match(name, self.pivot, d, data)
+            else:
+                start = time.time()
+                matches = meth.match(name, self.pivot, d, data)
+                profile.record_call(meth.name, d.name, time.time() - start)
+            if matches:
+                res[meth.name] = matches
+
+        all_terms = set()
+        for meth, terms in fused:
+            all_terms.update(terms)
+        if not all_terms:
+            return res
+
+        if profile is not None:
+            start = time.time()
+        enq = xapian.Enquire(d.db)
+        enq.set_query(xapian.Query(xapian.Query.OP_OR, sorted(all_terms)))
+        mset = enq.get_mset(0, sum([d.db.get_termfreq(t) for t in all_terms]))
+        if profile is not None:
+            profile.record_query("fused", d.name, len(all_terms), len(mset), mset.get_matches_estimated())
+        for m in mset:
+            matching = set(enq.matching_terms(m.docid))
+            pkg = m.document.get_data()
+            for meth, terms in fused:
+                if not terms.isdisjoint(matching):
+                    res.setdefault(meth.name, []).append(pkg)
+        if profile is not None:
+            profile.record_call("fused", d.name, time.time() - start)
+        return res
+
+    def match_distros(self, name, distros):
+        prepared = self.prepare_all(name)
+        res = dict()
+        for d in distros:
+            for meth_name, matches in self.match_target(name, prepared, d).iteritems():
+                names, meths = res.setdefault(d.name, (set(), set()))
+                names.update(matches)
+                meths.add(meth_name)
+        return res
+
+class TermTables(object):
+    """
+    In-memory copy of the term postings of some distros.
+
+    Tables are loaded on first use, one (distro, prefix) pair at a time. Note
+    that, like Xapian, a prefix also selects all the longer prefixes that start
+    with it: the table for "XFD" also contains the "XFDL" terms.
+    """
+    def __init__(self):
+        # (distro name, prefix) -> dict(term -> tuple(docids))
+        self.postings = dict()
+        # (distro name, prefix) -> dict(docid -> [terms])
+        self.inverted = dict()
+        # distro name -> dict(docid -> package name)
+        self.names = dict()
+
+    def table(self, d, pfx):
+        "Return the term -> docids table for the given prefix in distro d"
+        key = (d.name, pfx)
+        res = self.postings.get(key, None)
+        if res is None:
+            res = dict()
+            for t in d.db.allterms(pfx):
+                res[t.term] = tuple([p.docid for p in d.db.postlist(t.term)])
+            log.debug("%s: loaded %d %s terms", d.name, len(res), pfx)
+            self.postings[key] = res
+        return res
+
+    def docids(self, d, pfx, term):
+        "Return the docids of the documents of d indexed with term"
+        return self.table(d, pfx).get(term, ())
+
+    def doc_terms(self, d, pfx):
+        "Return the docid -> terms table for the given prefix in distro d"
+        key = (d.name, pfx)
+        res = self.inverted.get(key, None)
+        if res is None:
+            res = dict()
+            for term, docids in sorted(self.table(d, pfx).iteritems()):
+                for docid in docids:
+                    res.setdefault(docid, []).append(term)
+            self.inverted[key] = res
+        return res
+
+    def doc_name(self, d, docid):
+        "Return the package name for a docid of d"
+        names = self.names.get(d.name, None)
+        if names is None:
+            names = dict()
+            for p in d.db.postlist(""):
+                names[p.docid] = d.db.get_document(p.docid).get_data()
+            self.names[d.name] = names
+        return names[docid]
+
+class BulkMatcher(Matcher):
+    """
+    Matcher optimised to match all the packages of the pivot distro.
+
+    It preloads the term postings of all distros, and computes matches by
+    joining them in memory, falling back to Xapian queries only when the
+    result would depend on ranking. Results are the same as Matcher's.
+    """
+    def __init__(self, distros, pivot, tables=None, cache=None, table=None, budget=None, profile=None):
+        Matcher.__init__(self, distros, pivot, cache, table, budget, profile)
+        if tables is None:
+            tables = TermTables()
+        self.tables = tables
+
+    def match_method(self, name, meth, d):
+        return meth.bulk_match(name, self.pivot, d, self.tables)
+
+def budget_changes(reference, budgeted, names):
+    """
+    Match names with the reference and budgeted matchers, generating
+    (name, distro, lost, gained) for each target distro where the matches
+    differ, with the sets of names that the budget lost and gained
+    """
+    for name in names:
+        before = reference.match(name) or dict()
+        after = budgeted.match(name) or dict()
+        for d in sorted(set(before.iterkeys()) | set(after.iterkeys())):
+            old = before.get(d, set())
+            new = after.get(d, set())
+            if old != new:
+                yield name, d, old - new, new - old
@@ -0,0 +1,286 @@
+# distromatch - Match binary package names across distributions
+#
+# Copyright (C) 2011  Enrico Zini <enrico@enricozini.org>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# Precomputed table of all the matches from a pivot distribution.
+#
+# File layout (all integers are little endian uint32):
+#
+#   header: magic, number of strings, methods, distros, rows, hash slots
+#           and match entries
+#   strings: offsets table (n_strings + 1 entries) and string blob, with
+#            all the names used in the file, each stored only once
+#   methods: string id of the name of each match method
+#   distros: (name, generation) string ids for each distro the table was
+#            computed from; the first one is the pivot
+#   rows: package name string id, bitmask of the methods that found
+#         matches, and offsets table (n_rows + 1 entries) into the entries
+#   entries: (distro index, package name string id) for each match
+#   hash: slots with row index + 1 for each package name, or 0 if empty,
+#         with linear probing
+
+import os
+import os.path
+import mmap
+import zlib
+import struct
+import logging
+from array import array
+import utils
+from contentcache import StringColumn, Strings, write_array
+
+log = logging.getLogger(__name__)
+
+MAGIC = "DMMT0001"
+HEADER = struct.Struct("<8sIIIIII")
+
+def name_hash(name):
+    "Hash function for the package name lookup table"
+    return zlib.crc32(name) & 0xffffffff
+
+def hash_size(count):
+    "Size of the hash table for count items: a power of two, at most half full"
+    size = 1
+    while size < count * 2:
+        size *= 2
+    return size
+
+class StringTable(object):
+    "Intern strings, assigning them consecutive ids"
+    def __init__(self, tmpdir=None):
+        self.ids = dict()
+        self.column = StringColumn(tmpdir)
+
+    def __call__(self, s):
+        res = self.ids.get(s, None)
+        if res is None:
+            res = self.ids[s] = self.column.append(s)
+        return res
+
+    def __len__(self):
+        return len(self.column)
+
+def write(fname, pivot, distros, methods, rows):
+    """
+    Write a match table to fname, atomically.
+
+    pivot is the name of the pivot distribution, distros a list of
+    (name, generation) for all the distributions, including the pivot,
+    methods a list of method names, and rows a sequence of (name, mask,
+    matches) for each package of the pivot, where mask has bit i set if
+    methods[i] found matches, and matches is a dict(distro=names).
+    """
+    tmpdir = os.path.dirname(os.path.abspath(fname))
+    strings = StringTable(tmpdir)
+    method_ids = array("I", [strings(m) for m in methods])
+    distros = [x for x in distros if x[0] == pivot] + [x for x in distros if x[0] != pivot]
+    distro_idx = dict([(name, idx) for idx, (name, gen) in enumerate(distros)])
+    distro_ids = array("I")
+    for name, gen in distros:
+        distro_ids.append(strings(name))
+        distro_ids.append(strings(gen))
+
+    row_names = array("I")
+    row_masks = array("I")
+    row_offsets = array("I", [0])
+    entries = array("I")
+    names = []
+    for name, mask, matches in rows:
+        names.append(name)
+        row_names.append(strings(name))
+        row_masks.append(mask)
+        for d, dnames in sorted(matches.iteritems()):
+            for n in sorted(dnames):
+                entries.append(distro_idx[d])
+                entries.append(strings(n))
+        row_offsets.append(len(entries) / 2)
+
+    slots = array("I", [0]) * hash_size(len(names))
+    mask = len(slots) - 1
+    for idx, name in enumerate(names):
+        pos = name_hash(name) & mask
+        while slots[pos] != 0:
+            pos = (pos + 1) & mask
+        slots[pos] = idx + 1
+
+    with utils.atomic_writer(fname) as out:
+        out.write(HEADER.pack(MAGIC, len(strings), len(method_ids), len(distros),
+                              len(row_names), len(slots), len(entries) / 2))
+        strings.column.write(out)
+        for arr in method_ids, distro_ids, row_names, row_masks, row_offsets, entries, slots:
+            write_array(out, arr)
+
+class MatchTable(object):
+    "Read access to a match table written by write"
+    def __init__(self, fname):
+        self.fname = fname
+        fd = open(fname, "rb")
+        try:
+            if os.fstat(fd.fileno()).st_size < HEADER.size:
+                raise ValueError("%s: file is too short" % fname)
+            self.mm = mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_READ)
+        finally:
+            fd.close()
+        (magic, n_strings, n_methods, n_distros, self.count, n_slots,
+         n_entries) = HEADER.unpack_from(self.mm, 0)
+        if magic != MAGIC:
+            raise ValueError("%s: not a match table file" % fname)
+        self.strings = Strings(self.mm, HEADER.size, n_strings)
+        offset = self.strings.blob + self.strings.blob_size()
+
+        ids = struct.unpack_from("<%dI" % n_methods, self.mm, offset)
+        self.methods = [self.strings[x] for x in ids]
+        offset += n_methods * 4
+
+        ids = struct.unpack_from("<%dI" % (n_distros * 2), self.mm, offset)
+        self.distros = [(self.strings[ids[i]], self.strings[ids[i + 1]]) for i in xrange(0, len(ids), 2)]
+        self.pivot = self.distros[0][0]
+        offset += n_distros * 8
+
+        self.row_names = offset
+        self.row_masks = self.row_names + self.count * 4
+        self.row_offsets = self.row_masks + self.count * 4
+        self.entries = self.row_offsets + (self.count + 1) * 4
+        self.slots = self.entries + n_entries * 8
+        self.slot_mask = n_slots - 1
+
+    def is_valid(self, generations):
+        """
+        Check if the table was computed from exactly the distributions, and
+        index generations, in the dict generations
+        """
+        if len(generations) != len(self.distros):
+            return False
+        for name, gen in self.distros:
+            current = generations.get(name, None)
+            if current is None or current != gen:
+                return False
+        return True
+
+    def name(self, row):
+        "Return the package name for a row"
+        return self.strings[struct.unpack_from("<I", self.mm, self.row_names + row * 4)[0]]
+
+    def lookup(self, name):
+        "Return the row for the package name, or None if it is not in the table"
+        pos = name_hash(name) & self.slot_mask
+        while True:
+            row = struct.unpack_from("<I", self.mm, self.slots + pos * 4)[0]
+            if row == 0:
+                return None
+            if self.name(row - 1) == name:
+                return row - 1
+            pos = (pos + 1) & self.slot_mask
+
+    def matches(self, row):
+        """
+        Return the names of the methods that found matches for row, and a
+        dict(distro=set(names)) with the matches
+        """
+        mask = struct.unpack_from("<I", self.mm, self.row_masks + row * 4)[0]
+        methods = [m for i, m in enumerate(self.methods) if mask & (1 << i)]
+        start, end = struct.unpack_from("<II", self.mm, self.row_offsets + row * 4)
+        res = dict()
+        if end > start:
+            ids = struct.unpack_from("<%dI" % ((end - start) * 2), self.mm, self.entries + start * 8)
+            for i in xrange(0, len(ids), 2):
+                res.setdefault(self.distros[ids[i]][0], set()).add(self.strings[ids[i + 1]])
+        return methods, res
+
+    def close(self):
+        self.mm.close()
+
+def table_path(tabledir, pivot):
+    "Return the pathname of the match table of a pivot distribution"
+    return os.path.join(tabledir, pivot + ".dmt")
+
+def open_table(tabledir, pivot, generations):
+    """
+    Open the match table of a pivot distribution, if it exists and it is up
+    to date with the given index generations. Returns None otherwise.
+    """
+    fname = table_path(tabledir, pivot)
+    if not os.path.exists(fname):
+        return None
+    try:
+        table = MatchTable(fname)
+    except Exception, e:
+        log.warning("%s: cannot read match table: %s", fname, str(e))
+        return None
+    if not table.is_valid(generations):
+        log.info("%s: match table is out of date, ignoring it", fname)
+        table.close()
+        return None
+    return table
+
+def build_table(distros, pivot, tabledir, tables=None):
+    """
+    Compute all the matches from the pivot distribution and write them to
+    its match table in tabledir.
+
+    tables is the TermTables to use, which can be shared across pivots to
+    load the term postings of each distribution only once.
+    """
+    import matcher
+    pivot = distros.distro_map[pivot]
+    m = matcher.BulkMatcher(distros.distros, pivot, tables=tables)
+    methods = [meth.name for meth in m.methods + m.fuzzy_methods]
+    bits = dict([(name, 1 << i) for i, name in enumerate(methods)])
+
+    def rows():
+        for name in sorted(pivot.all_packages()):
+            found = m.match_distros(name, m.distros)
+            mask = 0
+            matches = dict()
+            for d, (names, meths) in found.iteritems():
+                matches[d] = names
+                for meth in meths:
+                    mask |= bits[meth]
+            yield name, mask, matches
+
+    if not os.path.isdir(tabledir):
+        os.makedirs(tabledir)
+    write(table_path(tabledir, pivot.name), pivot.name,
+          [(d.name, d.generation()) for d in distros.distros], methods, rows())
+
+def build_tables(distros, tabledir, names=None, force=False):
+    """
+    Build the match tables for the given pivot distributions, or for all of
+    them.
+
+    Tables that are already up to date are kept, unless force is True, so
+    an interrupted run can be restarted without redoing the pivots that
+    were completed. Returns the list of pivots whose table was built.
+    """
+    if names is None:
+        names = [d.name for d in distros.distros]
+    generations = dict([(d.name, d.generation()) for d in distros.distros])
+    if None in generations.values():
+        raise RuntimeError("some indices have no generation stamp: reindex them first")
+    import matcher
+    tables = matcher.TermTables()
+    built = []
+    for name in names:
+        if not force:
+            table = open_table(tabledir, name, generations)
+            if table is not None:
+                table.close()
+                log.info("%s: match table is up to date", name)
+                continue
+        log.info("%s: building match table", name)
+        build_table(distros, name, tabledir, tables)
+        built.append(name)
+    return built
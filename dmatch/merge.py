@@ -0,0 +1,145 @@
+# distromatch - Match binary package names across distributions
+#
+# Copyright (C) 2011  Enrico Zini <enrico@enricozini.org>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# Merge the input files of several distributions into one, like
+# "zcat ... | LC_ALL=C sort -u | gzip", but without sorting inputs that are
+# already sorted
+
+import os
+import os.path
+import heapq
+import logging
+import multiprocessing
+from gzip import GzipFile
+import utils
+from utils import UnsortedInput
+
+log = logging.getLogger(__name__)
+
+# Input files of a distribution that get merged
+FILES = ("binsrc", "interesting-files")
+
+def input_path(dirname, fname):
+    "Return the pathname of the input file fname in dirname, or None if missing"
+    for path in (os.path.join(dirname, fname + ".gz"), os.path.join(dirname, fname)):
+        if os.path.exists(path):
+            return path
+    return None
+
+def read_lines(path):
+    "Generate the lines of a possibly compressed file, without line endings"
+    if path.endswith(".gz"):
+        fd = GzipFile(path, "r")
+    else:
+        fd = open(path)
+    try:
+        for line in fd:
+            yield line.rstrip("\n")
+    finally:
+        fd.close()
+
+def check_sorted(lines, path):
+    "Pass through lines, raising UnsortedInput if they are not in byte order"
+    last = None
+    for line in lines:
+        if last is not None and line < last:
+            raise UnsortedInput("%s is not sorted: %r comes after %r" % (path, line, last))
+        last = line
+        yield line
+
+def merge_sorted(paths):
+    """
+    Generate the unique lines of all the files in paths, in byte order,
+    assuming each file is already sorted. Raises UnsortedInput if one is not.
+    """
+    last = None
+    for line in heapq.merge(*[check_sorted(read_lines(p), p) for p in paths]):
+        if line != last:
+            yield line
+            last = line
+
+def merge_unsorted(paths, tmpdir=None):
+    "Generate the unique lines of all the files in paths, in byte order"
+    def lines():
+        for p in paths:
+            for line in read_lines(p):
+                yield line
+    return utils.external_sort(lines(), tmpdir=tmpdir)
+
+def write_lines(fname, lines):
+    "Write lines to the gzipped file fname, atomically. Returns their count"
+    count = 0
+    with utils.atomic_writer(fname) as out:
+        gz = GzipFile(fileobj=out, mode="wb", compresslevel=6)
+        for line in lines:
+            gz.write(line)
+            gz.write("\n")
+            count += 1
+        gz.close()
+    return count
+
+def merge_file(target, dirs, fname):
+    """
+    Merge the input file fname of all the directories in dirs into
+    target/fname.gz.
+
+    Returns the number of lines written, or None if no directory has the
+    file.
+    """
+    paths = []
+    for d in dirs:
+        path = input_path(d, fname)
+        if path is None:
+            log.warning("%s: no %s file, skipping it", d, fname)
+            continue
+        paths.append(path)
+    if not paths:
+        return None
+    dest = os.path.join(target, fname + ".gz")
+    try:
+        count = write_lines(dest, merge_sorted(paths))
+    except UnsortedInput, e:
+        log.info("%s: %s: sorting all input", dest, str(e))
+        count = write_lines(dest, merge_unsorted(paths, tmpdir=target))
+    log.info("%s: %d lines merged from %d files", dest, count, len(paths))
+    return count
+
+def _merge_file(args):
+    "Run merge_file in a worker process"
+    return args[2], merge_file(*args)
+
+def merge_datadirs(target, dirs, jobs=len(FILES)):
+    """
+    Merge the input files of all the distribution directories in dirs into
+    target, processing the different files in parallel with up to jobs
+    worker processes.
+
+    Returns a dict mapping each file name to the number of lines written.
+    """
+    args = [(target, dirs, fname) for fname in FILES]
+    if jobs <= 1:
+        return dict(map(_merge_file, args))
+    pool = multiprocessing.Pool(min(jobs, len(args)))
+    try:
+        res = dict(pool.map(_merge_file, args))
+        pool.close()
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+    return res
@@ -0,0 +1,152 @@
+# distromatch - Match binary package names across distributions
+#
+# Copyright (C) 2011  Enrico Zini <enrico@enricozini.org>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# Hash table from package name to Xapian document id, written next to the
+# index of a distribution so that exact name lookups do not need to run a
+# query.
+#
+# File layout (all integers are little endian uint32):
+#
+#   header: magic, number of strings and hash slots
+#   strings: offsets table (n_strings + 1 entries) and string blob; the
+#            first string is the index generation the table was built
+#            from, the others are the lowercased package names
+#   docids: document id of each package name, or 0 if the name has more
+#           than one document
+#   hash: slots with name index + 1 for each package name, or 0 if empty,
+#         with linear probing
+
+import os
+import os.path
+import mmap
+import struct
+import logging
+from array import array
+import utils
+from contentcache import StringColumn, Strings, write_array
+from matchtable import name_hash, hash_size
+
+log = logging.getLogger(__name__)
+
+MAGIC = "DMNT0001"
+HEADER = struct.Struct("<8sII")
+
+# docid stored for names that have more than one document
+AMBIGUOUS = 0
+
+def write(fname, generation, items):
+    """
+    Write a name table to fname, atomically.
+
+    items is a sequence of (name, docids) for each lowercased package name
+    """
+    tmpdir = os.path.dirname(os.path.abspath(fname))
+    strings = StringColumn(tmpdir)
+    strings.append(generation)
+    names = []
+    docids = array("I")
+    for name, ids in items:
+        strings.append(name)
+        names.append(name)
+        if len(ids) == 1:
+            docids.append(ids[0])
+        else:
+            docids.append(AMBIGUOUS)
+
+    slots = array("I", [0]) * hash_size(len(names))
+    mask = len(slots) - 1
+    for idx, name in enumerate(names):
+        pos = name_hash(name) & mask
+        while slots[pos] != 0:
+            pos = (pos + 1) & mask
+        slots[pos] = idx + 1
+
+    with utils.atomic_writer(fname) as out:
+        out.write(HEADER.pack(MAGIC, len(strings), len(slots)))
+        strings.write(out)
+        write_array(out, docids)
+        write_array(out, slots)
+
+def write_for_db(fname, db, generation):
+    "Write the name table for all the XP terms of the Xapian database db"
+    def items():
+        for t in db.allterms("XP"):
+            # Skip the XPS terms: names are lowercased, so an uppercase
+            # letter after XP can only be part of a longer prefix
+            if t.term[2:3].isupper(): continue
+            yield t.term[2:], [p.docid for p in db.postlist(t.term)]
+    write(fname, generation, items())
+
+class NameTable(object):
+    "Read access to a name table written by write"
+    def __init__(self, fname):
+        self.fname = fname
+        fd = open(fname, "rb")
+        try:
+            if os.fstat(fd.fileno()).st_size < HEADER.size:
+                raise ValueError("%s: file is too short" % fname)
+            self.mm = mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_READ)
+        finally:
+            fd.close()
+        magic, n_strings, n_slots = HEADER.unpack_from(self.mm, 0)
+        if magic != MAGIC:
+            raise ValueError("%s: not a name table file" % fname)
+        self.strings = Strings(self.mm, HEADER.size, n_strings)
+        self.generation = self.strings[0]
+        self.count = n_strings - 1
+        self.docids = self.strings.blob + self.strings.blob_size()
+        self.slots = self.docids + self.count * 4
+        self.slot_mask = n_slots - 1
+
+    def __len__(self):
+        return self.count
+
+    def lookup(self, name):
+        """
+        Return the document id for the lowercased package name, None if the
+        name is not in the table, or AMBIGUOUS if it has more than one
+        document
+        """
+        pos = name_hash(name) & self.slot_mask
+        while True:
+            idx = struct.unpack_from("<I", self.mm, self.slots + pos * 4)[0]
+            if idx == 0:
+                return None
+            if self.strings[idx] == name:
+                return struct.unpack_from("<I", self.mm, self.docids + (idx - 1) * 4)[0]
+            pos = (pos + 1) & self.slot_mask
+
+    def close(self):
+        self.mm.close()
+
+def open_table(fname, generation):
+    """
+    Open a name table, if it exists and it was built from the index
+    generation given. Returns None otherwise.
+    """
+    if generation is None or not os.path.exists(fname):
+        return None
+    try:
+        table = NameTable(fname)
+    except Exception, e:
+        log.warning("%s: cannot read name table: %s", fname, str(e))
+        return None
+    if table.generation != generation:
+        log.info("%s: name table is out of date, ignoring it", fname)
+        table.close()
+        return None
+    return table
@@ -0,0 +1,210 @@
+# distromatch - Match binary package names across distributions
+#
+# Copyright (C) 2011  Enrico Zini <enrico@enricozini.org>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os.path
+import multiprocessing
+import logging
+import traceback
+import distro
+
+log = logging.getLogger(__name__)
+
+# Matcher used by the current worker process
+_worker_matcher = None
+
+def _init_match_worker(root, pivot, bulk, fused, budget):
+    "Open the indices and create a matcher in a worker process"
+    global _worker_matcher
+    distros = distro.Distros(root=root)
+    _worker_matcher = distros.make_matcher(pivot, bulk=bulk, fused=fused, budget=budget)
+
+def _match_chunk(names):
+    """
+    Match a list of package names in a worker process.
+
+    Returns a list of (name, found, matches) and the match statistics for the
+    chunk.
+    """
+    matcher = _worker_matcher
+    matcher.reset_counts()
+    res = []
+    for name in names:
+        if not matcher.pivot.has_package(name):
+            res.append((name, False, None))
+            continue
+        res.append((name, True, matcher.match(name)))
+    return res, matcher.get_counts()
+
+def match_parallel(matcher, names, jobs, root=".", bulk=True, chunk_size=100, fused=False):
+    """
+    Match names with matcher, sharding the work across jobs worker processes.
+
+    Each worker opens its own copy of the indices in root. Generate (name,
+    found, matches) tuples in the same order as names, where found is False
+    if the package does not exist in the pivot distribution. The match
+    statistics of the workers are added to those of matcher.
+    """
+    chunks = [names[i:i+chunk_size] for i in xrange(0, len(names), chunk_size)]
+    pool = multiprocessing.Pool(jobs, _init_match_worker,
+                                (root, matcher.pivot.name, bulk, fused, matcher.budget))
+    try:
+        for res, counts in pool.imap(_match_chunk, chunks):
+            matcher.add_counts(counts)
+            for item in res:
+                yield item
+        pool.close()
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+
+def _reindex_distro(args):
+    """
+    Reindex a distribution in a worker process.
+
+    Returns the distribution name and, if the reindex failed, the error
+    """
+    name, root, incremental, shards = args
+    try:
+        distro.Distro(name, reindex=True, root=root, incremental=incremental, shards=shards)
+    except Exception, e:
+        log.debug("%s: reindex failed: %s", name, traceback.format_exc())
+        return name, str(e)
+    return name, None
+
+def reindex_parallel(names, root=".", jobs=1, incremental=False, shards=1):
+    """
+    Reindex the given distributions in root, one per worker process, with up
+    to jobs processes running at the same time.
+
+    A failure in one distribution does not stop the others. Returns a dict
+    mapping the names of the distributions that failed to their error.
+    """
+    failed = dict()
+    if not names:
+        return failed
+    pool = multiprocessing.Pool(min(jobs, len(names)))
+    try:
+        for name, error in pool.imap_unordered(_reindex_distro, [(x, root, incremental, shards) for x in names]):
+            if error is None:
+                log.info("%s: reindexed", name)
+            else:
+                failed[name] = error
+        pool.close()
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+    return failed
+
+def _index_shard(args):
+    """
+    Index one shard of a distribution in a worker process.
+
+    Returns the number of package names indexed and the stemmer statistics
+    """
+    name, style, root, shard, shards, path = args
+    d = distro.Distro(name, style=style, root=root)
+    db, count, stem_stats = d.build_db(path, shard, shards)
+    db.flush()
+    return count, stem_stats
+
+def index_shards(d, paths):
+    """
+    Index the packages of the distribution d in len(paths) shards, each in
+    a new database in the corresponding path, using one worker process per
+    shard.
+
+    Returns the list of (count, stem_stats) returned by build_db for each
+    shard.
+    """
+    root = os.path.dirname(d.root)
+    args = [(d.name, d.style, root, i, len(paths), path) for i, path in enumerate(paths)]
+    # Worker processes, like those of reindex_parallel, cannot start their
+    # own pool: index the shards one after the other
+    if multiprocessing.current_process().daemon:
+        return map(_index_shard, args)
+    pool = multiprocessing.Pool(len(paths))
+    try:
+        res = pool.map(_index_shard, args)
+        pool.close()
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+    return res
+
+def warm_cache(distros, pivot, cachedir):
+    """
+    Match all the packages of the pivot distribution, filling the match
+    cache in cachedir. Returns the number of packages matched.
+    """
+    matcher = distros.make_matcher(pivot, bulk=True, cachedir=cachedir)
+    if matcher is None:
+        raise RuntimeError("distribution %s not found" % pivot)
+    try:
+        count = 0
+        for name in sorted(matcher.pivot.all_packages()):
+            matcher.match(name)
+            count += 1
+    finally:
+        matcher.close()
+    return count
+
+def _warm_cache_distro(args):
+    """
+    Warm the match cache of a pivot distribution in a worker process.
+
+    Returns the distribution name, the number of packages matched and, if
+    warming the cache failed, the error
+    """
+    pivot, root, cachedir = args
+    try:
+        count = warm_cache(distro.Distros(root=root), pivot, cachedir)
+    except Exception, e:
+        log.debug("%s: warming match cache failed: %s", pivot, traceback.format_exc())
+        return pivot, 0, str(e)
+    return pivot, count, None
+
+def warm_cache_parallel(names, root=".", cachedir=None, jobs=1):
+    """
+    Warm the match caches of the given pivot distributions, one per worker
+    process, with up to jobs processes running at the same time.
+
+    Returns a dict mapping the names of the distributions that failed to
+    their error.
+    """
+    failed = dict()
+    if not names:
+        return failed
+    pool = multiprocessing.Pool(min(jobs, len(names)))
+    try:
+        for name, count, error in pool.imap_unordered(_warm_cache_distro, [(x, root, cachedir) for x in names]):
+            if error is None:
+                log.info("%s: match cache warmed with %d packages", name, count)
+            else:
+                failed[name] = error
+        pool.close()
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+    return failed
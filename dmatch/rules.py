@@ -134,6 +134,87 @@ CONTENT_INFO = {
             sophie=dict(like=["/usr/%/python%/site-packages/%"])),
 }
 
+class ContentClassifier(object):
+    """
+    Classify file names using a list of (kind, regexp) matchers, where each
+    regexp captures the interesting part of the name in its first group.
+
+    The regexps are combined in a single one, so that a name can be
+    classified, or rejected, with only one regexp match.
+    """
+    def __init__(self, matchers):
+        self.matchers = list(matchers)
+        # For each position in matchers, the combined regexp of all the
+        # matchers from that position on, and a map from its group indices to
+        # (position, kind)
+        self.combined = []
+        for start in range(len(self.matchers)):
+            parts = []
+            groups = dict()
+            group = 1
+            for pos in range(start, len(self.matchers)):
+                kind, regexp = self.matchers[pos]
+                parts.append("(%s)" % regexp.pattern)
+                groups[group] = (pos, kind)
+                group += 1 + regexp.groups
+            self.combined.append((re.compile("|".join(parts)), groups))
+
+    def match_all(self, fname):
+        """
+        Return the list of (kind, captured) for all the matchers that match
+        fname, in the same order as the matchers
+        """
+        res = []
+        start = 0
+        while start < len(self.combined):
+            regexp, groups = self.combined[start]
+            mo = regexp.match(fname)
+            if mo is None: break
+            # The group of the whole alternative is the last one to close
+            pos, kind = groups[mo.lastindex]
+            captured = mo.group(mo.lastindex + 1)
+            if captured:
+                res.append((kind, captured))
+            start = pos + 1
+        return res
+
+    def match(self, fname):
+        """
+        Return (kind, captured) for the first matcher that matches fname, or
+        None if nothing matches
+        """
+        start = 0
+        while start < len(self.combined):
+            regexp, groups = self.combined[start]
+            mo = regexp.match(fname)
+            if mo is None: break
+            pos, kind = groups[mo.lastindex]
+            captured = mo.group(mo.lastindex + 1)
+            if captured:
+                return kind, captured
+            start = pos + 1
+        return None
+
+    def match_batch(self, fnames):
+        """
+        Classify a sequence of file names, returning a list of (index, kind,
+        captured) with the position in fnames of each name that matched
+        """
+        res = []
+        match_all = self.match_all
+        for idx, fname in enumerate(fnames):
+            for kind, captured in match_all(fname):
+                res.append((idx, kind, captured))
+        return res
+
+# Classifier for file names, using all the regexps in CONTENT_INFO
+CONTENT_CLASSIFIER = ContentClassifier(
+        [(k, v.regexp) for k, v in CONTENT_INFO.iteritems()])
+
+# Classifier for rpm-md provides, using all the rpm_md regexps in CONTENT_INFO
+PROVIDES_CLASSIFIER = ContentClassifier(
+        [(k, v.rpm_md) for k, v in CONTENT_INFO.iteritems() if v.rpm_md is not None])
+
 PREFIX_DOC = {
     "XP": "package name",
     "XPS": "source package name",
@@ -0,0 +1,350 @@
+# distromatch - Match binary package names across distributions
+#
+# Copyright (C) 2011  Enrico Zini <enrico@enricozini.org>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# Long running query server, answering match, dump and has-package queries
+# over local HTTP or a Unix socket, using JSON.
+#
+# Requests:
+#
+#   GET /distros
+#   GET /match?distro=DISTRO&pkg=NAME[&pkg=NAME...]
+#   GET /has-package?distro=DISTRO&pkg=NAME[&pkg=NAME...]
+#   GET /dump?distro=DISTRO&pkg=NAME[&pkg=NAME...]
+#   POST /batch, with a JSON body like:
+#     {"requests": [{"op": "match", "distro": "debian", "packages": ["gimp"]}]}
+#
+# The indices are reloaded when their files change, or on SIGHUP.
+
+import os
+import os.path
+import time
+import json
+import signal
+import logging
+import urlparse
+import SocketServer
+import BaseHTTPServer
+from cStringIO import StringIO
+import xapian
+import distro
+
+log = logging.getLogger(__name__)
+
+class QueryError(Exception):
+    "Error in a query, reported to the client"
+    def __init__(self, msg, code=400):
+        super(QueryError, self).__init__(msg)
+        self.code = code
+
+def index_stamp(root):
+    """
+    Compute a value that changes when any of the indices in root is
+    replaced or modified, or when distributions are added or removed
+    """
+    res = []
+    for d in sorted(os.listdir(root)):
+        if not d.startswith("dist-"): continue
+        dbpath = os.path.join(root, d, "db")
+        try:
+            st = os.stat(dbpath)
+            names = sorted(os.listdir(dbpath))
+        except OSError:
+            res.append((d, None))
+            continue
+        files = []
+        for name in names:
+            try:
+                fst = os.stat(os.path.join(dbpath, name))
+            except OSError:
+                continue
+            files.append((name, fst.st_ino, fst.st_size, fst.st_mtime))
+        res.append((d, st.st_ino, tuple(files)))
+    return tuple(res)
+
+class Snapshot(object):
+    """
+    A consistent set of open indices, with the matchers created on them.
+
+    All the indices and name tables are opened when the snapshot is
+    created, and a missing or unreadable one makes it fail. Missing indices
+    are built only if build is True.
+    """
+    def __init__(self, root, distros=None, cachedir=None, build=False):
+        self.stamp = index_stamp(root)
+        if distros is None:
+            distros = distro.Distros(root=root)
+        for d in distros.distros:
+            if not build and not os.path.exists(d.dbpath):
+                raise RuntimeError("%s: index %s not found" % (d.name, d.dbpath))
+            d.db
+            d.name_table
+        self.distros = distros
+        self.cachedir = cachedir
+        # Precomputed match tables are used when they are up to date
+        self.tabledir = os.path.join(root, "match-table")
+        self.matchers = dict()
+
+    def get_distro(self, name):
+        d = self.distros.distro_map.get(name, None)
+        if d is None:
+            raise QueryError("distribution %s not found" % name, 404)
+        return d
+
+    def get_matcher(self, name):
+        m = self.matchers.get(name, None)
+        if m is None:
+            self.get_distro(name)
+            m = self.matchers[name] = self.distros.make_matcher(
+                    name, cachedir=self.cachedir, tabledir=self.tabledir)
+        return m
+
+    def reopen(self):
+        """
+        Reopen the indices at their latest revision, after they were modified
+        while open, dropping what was read from them
+        """
+        self.close()
+        self.matchers = dict()
+        for d in self.distros.distros:
+            if "db" in d.__dict__:
+                d.db.reopen()
+            d.__dict__.pop("postings", None)
+            d.__dict__.pop("name_table", None)
+
+    def close(self):
+        "Save the match caches"
+        for m in self.matchers.itervalues():
+            m.close()
+
+class Service(object):
+    """
+    Answer queries about the indices in root, keeping them open across
+    queries and reloading them when they change.
+    """
+    def __init__(self, root=".", distros=None, check_interval=5, cachedir=None):
+        self.root = root
+        # Seconds between checks for changes in the indices
+        self.check_interval = check_interval
+        # Directory with the persistent match caches, if any
+        self.cachedir = cachedir
+        self.snapshot = Snapshot(root, distros, cachedir, build=True)
+        self.last_check = time.time()
+        self.reload_requested = False
+
+    def request_reload(self):
+        "Reload the indices before answering the next query"
+        self.reload_requested = True
+
+    def maybe_reload(self):
+        """
+        Reload the indices if requested or if they changed.
+
+        The new indices are all opened before replacing the current ones, so
+        that queries always see a consistent set.
+        """
+        now = time.time()
+        if not self.reload_requested and now - self.last_check < self.check_interval:
+            return False
+        self.last_check = now
+        if not self.reload_requested and index_stamp(self.root) == self.snapshot.stamp:
+            return False
+        self.reload_requested = False
+        log.info("reloading indices in %s", self.root)
+        try:
+            snapshot = Snapshot(self.root, cachedir=self.cachedir)
+        except Exception, e:
+            log.error("cannot reload indices, keeping the old ones: %s", str(e))
+            return False
+        self.snapshot.close()
+        self.snapshot = snapshot
+        return True
+
+    def run(self, func):
+        """
+        Run func(self), retrying it once if an index was modified while it
+        was being read
+        """
+        try:
+            return func(self)
+        except xapian.DatabaseModifiedError, e:
+            log.info("indices modified while reading them, reopening: %s", str(e))
+            self.snapshot.reopen()
+            return func(self)
+
+    def distros(self):
+        return [dict(name=d.name, style=d.style) for d in self.snapshot.distros.distros]
+
+    def match(self, distro, packages):
+        snapshot = self.snapshot
+        matcher = snapshot.get_matcher(distro)
+        res = []
+        for name in packages:
+            if not matcher.pivot.has_package(name):
+                res.append(dict(package=name, found=False))
+                continue
+            m = matcher.match(name) or dict()
+            res.append(dict(package=name, found=True,
+                            matches=dict((k, sorted(v)) for k, v in m.iteritems())))
+        return res
+
+    def has_package(self, distro, packages):
+        d = self.snapshot.get_distro(distro)
+        return [dict(package=name, found=d.has_package(name)) for name in packages]
+
+    def dump(self, distro, packages):
+        d = self.snapshot.get_distro(distro)
+        res = []
+        for name in packages:
+            if not d.has_package(name):
+                res.append(dict(package=name, found=False))
+                continue
+            out = StringIO()
+            d.dump_info(name, out)
+            res.append(dict(package=name, found=True, info=out.getvalue()))
+        return res
+
+    OPS = {
+        "match": match,
+        "has-package": has_package,
+        "dump": dump,
+    }
+
+    def query(self, op, distro, packages):
+        "Run a query, returning a list with a result for each package"
+        func = self.OPS.get(op, None)
+        if func is None:
+            raise QueryError("unknown operation %s" % op, 404)
+        if not distro:
+            raise QueryError("missing distribution name")
+        return func(self, distro, packages)
+
+    def batch(self, requests):
+        "Run a list of queries, all on the same set of indices"
+        res = []
+        for req in requests:
+            try:
+                res.append(dict(results=self.query(
+                    req.get("op"), req.get("distro"), req.get("packages", []))))
+            except QueryError, e:
+                res.append(dict(error=str(e)))
+        return res
+
+class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    # Close the connection after each response: the servers handle one
+    # connection at a time, and a client keeping it alive would block all
+    # the others
+    protocol_version = "HTTP/1.0"
+
+    def send_json(self, data, code=200):
+        body = json.dumps(data)
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def handle_query(self, func):
+        service = self.server.service
+        try:
+            service.maybe_reload()
+            self.send_json(service.run(func))
+        except QueryError, e:
+            self.send_json(dict(error=str(e)), e.code)
+        except Exception, e:
+            log.exception("cannot answer %s", self.path)
+            self.send_json(dict(error=str(e)), 500)
+
+    def do_GET(self):
+        url = urlparse.urlparse(self.path)
+        args = urlparse.parse_qs(url.query)
+        if url.path == "/distros":
+            self.handle_query(lambda s: dict(distros=s.distros()))
+        else:
+            op = url.path.lstrip("/")
+            distro = args.get("distro", [None])[0]
+            packages = args.get("pkg", [])
+            self.handle_query(lambda s: dict(results=s.query(op, distro, packages)))
+
+    def do_POST(self):
+        url = urlparse.urlparse(self.path)
+        if url.path != "/batch":
+            self.send_json(dict(error="unknown operation %s" % url.path), 404)
+            return
+        try:
+            size = int(self.headers.get("Content-Length", 0))
+            data = json.loads(self.rfile.read(size))
+            requests = data["requests"]
+        except (ValueError, KeyError, TypeError), e:
+            self.send_json(dict(error="invalid batch request: %s" % str(e)), 400)
+            return
+        self.handle_query(lambda s: dict(responses=s.batch(requests)))
+
+    def address_string(self):
+        if isinstance(self.client_address, tuple):
+            return self.client_address[0]
+        return "unix"
+
+    def log_message(self, format, *args):
+        log.info("%s %s", self.address_string(), format % args)
+
+# Xapian databases cannot be used by many threads at the same time, so the
+# servers handle one request at a time: clients can use batches to amortise
+# the round trips.
+class HTTPServer(BaseHTTPServer.HTTPServer):
+    def __init__(self, address, service):
+        BaseHTTPServer.HTTPServer.__init__(self, address, Handler)
+        self.service = service
+
+class UnixHTTPServer(SocketServer.UnixStreamServer):
+    def __init__(self, path, service):
+        if os.path.exists(path):
+            os.unlink(path)
+        SocketServer.UnixStreamServer.__init__(self, path, Handler)
+        self.server_name = "localhost"
+        self.server_port = 0
+        self.service = service
+
+def make_server(address, service):
+    """
+    Create a server for address, which can be a [host:]port pair or the
+    path of a Unix socket
+    """
+    if "/" in address:
+        return UnixHTTPServer(address, service)
+    if ":" in address:
+        host, port = address.rsplit(":", 1)
+    else:
+        host, port = "localhost", address
+    return HTTPServer((host, int(port)), service)
+
+def serve(address, root=".", distros=None, cachedir=None):
+    """
+    Answer queries about the indices in root on address, until interrupted.
+
+    If cachedir is given, keep persistent match caches in it.
+    """
+    service = Service(root, distros, cachedir=cachedir)
+    server = make_server(address, service)
+    signal.signal(signal.SIGHUP, lambda signum, frame: service.request_reload())
+    log.info("serving queries on %s", address)
+    try:
+        server.serve_forever()
+    finally:
+        service.snapshot.close()
+        server.server_close()
+        if isinstance(server, UnixHTTPServer):
+            os.unlink(address)
@@ -0,0 +1,319 @@
+# distromatch - Match binary package names across distributions
+#
+# Copyright (C) 2011  Enrico Zini <enrico@enricozini.org>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# Generate synthetic datasets for tests and benchmarks.
+#
+# The same set of upstream projects is packaged in every distribution,
+# named following the conventions of each style in STEMMERS, with some
+# projects and files missing here and there. The file lists go through
+# CONTENT_CLASSIFIER like those of the real exporters, and the output is
+# sorted in byte order like theirs.
+
+import os
+import os.path
+import zlib
+import gzip
+import random
+import hashlib
+from rules import STEMMERS, CONTENT_CLASSIFIER
+
+SYLLABLES = ("ka", "ro", "mi", "tu", "sen", "bar", "vo", "lex", "dra", "qui",
+             "pel", "zor", "fi", "gno", "mu", "tar", "wen", "xy", "co", "dal",
+             "ne", "ost", "ry", "sha", "ub", "vin")
+
+# Kinds of upstream projects, and how often they occur
+KINDS = (("app", 25), ("tool", 20), ("lib", 25), ("perl", 15), ("python", 15))
+
+# Mean number of binary packages for a project of each kind
+PACKAGES_PER_KIND = dict(app=1, tool=1, lib=2, perl=1, python=1)
+
+# Mean number of interesting files per package without extra files
+BASE_FILES = 1.8
+
+# Probability that a distribution packages a project, and that a package
+# ships one of the files of the project
+P_PROJECT = 0.9
+P_FILE = 0.95
+
+def make_rng(*args):
+    "Return a random generator seeded deterministically from args"
+    return random.Random(zlib.crc32(":".join([str(x) for x in args])) & 0xffffffff)
+
+class Project(object):
+    "An upstream project, packaged in various ways by the distributions"
+    __slots__ = ("name", "kind", "soversion", "extra")
+
+    def __init__(self, name, kind, soversion, extra):
+        self.name = name
+        self.kind = kind
+        self.soversion = soversion
+        self.extra = extra
+
+    def perl_module(self):
+        "Perl module name for perl projects: the name split in two parts"
+        half = max(2, len(self.name) / 2)
+        return "%s::%s" % (self.name[:half].capitalize(), self.name[half:].capitalize())
+
+    def packages(self, style):
+        """
+        Return a list of (binary name, source name, [paths]) for the packages
+        of this project in a distribution of the given style
+        """
+        name = self.name
+        rpm = style != "debian"
+        libdir = "usr/lib64" if style == "fedora" else "usr/lib"
+        extra = ["usr/share/man/man1/%s-%d.1.gz" % (name, i) for i in range(self.extra)]
+        doc = lambda pkg: ["usr/share/doc/%s/copyright" % pkg]
+        if self.kind == "app":
+            return [(name, name, ["usr/bin/" + name,
+                                  "usr/share/man/man1/%s.1.gz" % name,
+                                  "usr/share/applications/%s.desktop" % name] + extra + doc(name))]
+        if self.kind == "tool":
+            return [(name, name, ["usr/bin/" + name, "usr/bin/%s-helper" % name,
+                                  "usr/share/man/man1/%s.1.gz" % name] + extra + doc(name))]
+        if self.kind == "lib":
+            shlib = "%s/lib%s.so.%d.0.0" % (libdir, name, self.soversion)
+            dev = ["%s/lib%s.a" % (libdir, name), "%s/pkgconfig/%s.pc" % (libdir, name),
+                   "usr/include/%s.h" % name] + \
+                  ["usr/share/man/man3/%s_%d.3.gz" % (name, i) for i in range(self.extra)]
+            if style == "debian":
+                shname, devname = "lib%s%d" % (name, self.soversion), "lib%s-dev" % name
+            elif style == "fedora":
+                shname, devname = "%s-libs" % name, "%s-devel" % name
+            elif style == "mandriva":
+                shname, devname = "lib%s%d" % (name, self.soversion), "lib%s-devel" % name
+            else:
+                shname, devname = "lib%s%d" % (name, self.soversion), "%s-devel" % name
+            return [(shname, name, [shlib] + doc(shname)), (devname, name, dev + doc(devname))]
+        if self.kind == "perl":
+            module = self.perl_module()
+            if rpm:
+                pkg = "perl-" + module.replace("::", "-")
+            else:
+                pkg = "lib%s-perl" % module.replace("::", "-").lower()
+            paths = ["usr/share/perl5/%s.pm" % module.replace("::", "/"),
+                     "usr/share/man/man3/%s.3pm.gz" % module] + \
+                    ["usr/share/man/man3/%s::Sub%d.3pm.gz" % (module, i) for i in range(self.extra)]
+            return [(pkg, pkg, paths + doc(pkg))]
+        # python
+        if style == "fedora":
+            pkg = "%s-python" % name
+        else:
+            pkg = "python-" + name
+        sitedir = "usr/lib/python2.7/%s/%s" % ("site-packages" if rpm else "dist-packages", name)
+        paths = ["%s/__init__.py" % sitedir] + ["%s/mod%d.py" % (sitedir, i) for i in range(self.extra)]
+        return [(pkg, pkg, paths + doc(pkg))]
+
+def make_projects(packages, content_lines=None, seed=0):
+    """
+    Create the list of projects for distributions of about the given number
+    of binary packages, with about content_lines interesting files overall
+    """
+    rng = make_rng("projects", seed)
+    kinds = []
+    for kind, weight in KINDS:
+        kinds.extend([kind] * weight)
+    # Each distribution only packages some of the projects and files
+    total = packages / P_PROJECT
+    if content_lines is None:
+        extra_mean = 0
+    else:
+        projects = total * len(kinds) / sum([PACKAGES_PER_KIND[k] for k in kinds])
+        extra_mean = max(0.0, (content_lines / (P_PROJECT * P_FILE) - BASE_FILES * total) / projects)
+    res = []
+    seen = set()
+    count = 0
+    while count < total:
+        name = "".join([rng.choice(SYLLABLES) for i in range(rng.randint(2, 5))])
+        if name in seen: continue
+        seen.add(name)
+        kind = rng.choice(kinds)
+        if extra_mean > 0:
+            extra = int(rng.expovariate(1.0 / extra_mean) + 0.5)
+        else:
+            extra = 0
+        res.append(Project(name, kind, rng.randint(0, 9), extra))
+        count += PACKAGES_PER_KIND[kind]
+    return res
+
+class SynthDistro(object):
+    """
+    The packages of a synthetic distribution of the given style.
+
+    Iterating it generates (binary name, source name, [paths]) for each
+    package, sorted by name. Paths are computed again on each iteration, so
+    that large distributions do not need to be kept in memory.
+    """
+    def __init__(self, projects, style, name=None, seed=0):
+        if name is None:
+            name = style
+        self.name = name
+        self.style = style
+        self.seed = seed
+        index = dict()
+        for p in projects:
+            for binname, srcname, paths in self.project_packages(p):
+                if binname in index: continue
+                index[binname] = (srcname, p)
+        # Sort like the lines of the output files, which start with "name "
+        self.index = [(b, s, p) for b, (s, p) in sorted(index.iteritems(), key=lambda x: x[0] + " ")]
+
+    def project_packages(self, project):
+        "Return the packages of project in this distribution"
+        rng = make_rng(self.name, project.name, self.seed)
+        if rng.random() >= P_PROJECT:
+            return []
+        res = []
+        for binname, srcname, paths in project.packages(self.style):
+            res.append((binname, srcname, [x for x in paths if rng.random() < P_FILE]))
+        return res
+
+    def __len__(self):
+        return len(self.index)
+
+    def __iter__(self):
+        for binname, srcname, project in self.index:
+            for b, s, paths in self.project_packages(project):
+                if b == binname:
+                    yield binname, srcname, paths
+                    break
+
+def write_distro(root, distro):
+    """
+    Write the style, binsrc.gz and interesting-files.gz of a SynthDistro in
+    root/dist-NAME. Returns the number of interesting-files lines.
+    """
+    d = os.path.join(root, "dist-" + distro.name)
+    if not os.path.isdir(d):
+        os.makedirs(d)
+    with open(os.path.join(d, "style"), "w") as fd:
+        print >>fd, distro.style
+    binsrc = gzip.GzipFile(os.path.join(d, "binsrc.gz"), "w", compresslevel=6)
+    files = gzip.GzipFile(os.path.join(d, "interesting-files.gz"), "w", compresslevel=6)
+    count = 0
+    try:
+        for binname, srcname, paths in distro:
+            binsrc.write("%s %s\n" % (binname, srcname))
+            lines = set()
+            for path in paths:
+                for kind, captured in CONTENT_CLASSIFIER.match_all(path):
+                    lines.add("%s %s %s\n" % (binname, kind, captured))
+            for line in sorted(lines):
+                files.write(line)
+            count += len(lines)
+    finally:
+        binsrc.close()
+        files.close()
+    return count
+
+def write_dataset(root, packages=1000, content_lines=None, styles=None, seed=0):
+    """
+    Write a dist-STYLE directory in root for each of the given styles (by
+    default, all those in STEMMERS), with about the given number of packages
+    and interesting files each.
+
+    Returns a dict mapping each distribution name to its number of packages
+    and interesting-files lines.
+    """
+    if styles is None:
+        styles = sorted(STEMMERS.iterkeys())
+    projects = make_projects(packages, content_lines, seed)
+    res = dict()
+    for style in styles:
+        distro = SynthDistro(projects, style, seed=seed)
+        res[style] = (len(distro), write_distro(root, distro))
+    return res
+
+def write_contents(fname, distro):
+    """
+    Write a Debian Contents file with the paths of the packages of a
+    SynthDistro. Lines are in package order, which the parsers do not
+    depend on.
+    """
+    out = gzip.GzipFile(fname, "w", compresslevel=6)
+    try:
+        out.write("This file maps each file available in the Debian GNU/Linux system to\n"
+                  "the package from which it originates.\n\n"
+                  "FILE                                                    LOCATION\n")
+        for binname, srcname, paths in distro:
+            for path in paths:
+                out.write("%-55s misc/%s\n" % (path, binname))
+    finally:
+        out.close()
+
+def write_rpm_md(repodir, distro):
+    "Write an rpm-md repository in repodir with the packages of a SynthDistro"
+    repodata = os.path.join(repodir, "repodata")
+    if not os.path.isdir(repodata):
+        os.makedirs(repodata)
+    primary = gzip.GzipFile(os.path.join(repodata, "primary.xml.gz"), "w", compresslevel=6)
+    filelists = gzip.GzipFile(os.path.join(repodata, "filelists.xml.gz"), "w", compresslevel=6)
+    try:
+        primary.write('<?xml version="1.0" encoding="UTF-8"?>\n'
+                      '<metadata xmlns="http://linux.duke.edu/metadata/common"'
+                      ' xmlns:rpm="http://linux.duke.edu/metadata/rpm" packages="%d">\n' % len(distro))
+        filelists.write('<?xml version="1.0" encoding="UTF-8"?>\n'
+                        '<filelists xmlns="http://linux.duke.edu/metadata/filelists"'
+                        ' packages="%d">\n' % len(distro))
+        for binname, srcname, paths in distro:
+            pkgid = hashlib.sha1(binname).hexdigest()
+            provides = [binname]
+            for path in paths:
+                base = os.path.basename(path)
+                if path.endswith(".pc"):
+                    provides.append("pkgconfig(%s)" % base[:-3])
+                elif ".so." in base:
+                    # libfoo.so.1.0.0 provides libfoo.so.1
+                    provides.append(".".join(base.split(".")[:3]))
+            primary.write('<package type="rpm">\n'
+                          '  <name>%s</name>\n  <arch>i686</arch>\n'
+                          '  <checksum type="sha" pkgid="YES">%s</checksum>\n'
+                          '  <format>\n    <rpm:sourcerpm>%s-1.0-1.src.rpm</rpm:sourcerpm>\n'
+                          '    <rpm:provides>\n' % (binname, pkgid, srcname))
+            for p in provides:
+                primary.write('      <rpm:entry name="%s"/>\n' % p)
+            primary.write('    </rpm:provides>\n')
+            for path in paths:
+                if path.startswith("usr/bin/"):
+                    primary.write('    <file>/%s</file>\n' % path)
+            primary.write('  </format>\n</package>\n')
+            filelists.write('<package pkgid="%s" name="%s" arch="i686">\n' % (pkgid, binname))
+            for path in paths:
+                filelists.write('  <file>/%s</file>\n' % path)
+            filelists.write('</package>\n')
+        primary.write('</metadata>\n')
+        filelists.write('</filelists>\n')
+    finally:
+        primary.close()
+        filelists.close()
+
+    hashes = []
+    for name in "primary.xml.gz", "filelists.xml.gz":
+        digest = hashlib.sha256()
+        with open(os.path.join(repodata, name)) as fd:
+            while True:
+                buf = fd.read(256 * 1024)
+                if not buf: break
+                digest.update(buf)
+        hashes.append(digest.hexdigest())
+    with open(os.path.join(repodata, "repomd.xml"), "w") as fd:
+        fd.write('<?xml version="1.0" encoding="UTF-8"?>\n'
+                 '<repomd xmlns="http://linux.duke.edu/metadata/repo">\n')
+        for (name, fname), digest in zip((("primary", "primary.xml.gz"), ("filelists", "filelists.xml.gz")), hashes):
+            fd.write('  <data type="%s">\n    <checksum type="sha256">%s</checksum>\n'
+                     '    <location href="repodata/%s"/>\n  </data>\n' % (name, digest, fname))
+        fd.write('</repomd>\n')
@@ -18,6 +18,8 @@
 import textwrap
 import tempfile
 import os.path
+import heapq
+import marshal
 
 # From http://code.activestate.com/recipes/363602-lazy-property-evaluation/
 class lazy_property(object):
@@ -82,3 +84,58 @@ class Sequence(object):
         self.val += 1
         return self.val
 
+
+class UnsortedInput(Exception):
+    "Input data that was expected to be sorted is not"
+    pass
+
+def merge_unique(*iterables):
+    """
+    Merge sorted iterables into one sorted sequence, skipping duplicates
+    """
+    last = None
+    first = True
+    for item in heapq.merge(*iterables):
+        if first or item != last:
+            yield item
+            last = item
+            first = False
+
+def _read_run(fd):
+    "Read back the items written by external_sort in a temporary file"
+    fd.seek(0)
+    while True:
+        try:
+            yield marshal.load(fd)
+        except EOFError:
+            break
+
+def external_sort(items, tmpdir=None, run_size=500000):
+    """
+    Sort and deduplicate a sequence of items, spilling runs of run_size items
+    to temporary files in tmpdir, so that memory use stays bounded.
+
+    Items must be serializable with marshal, like tuples of strings.
+    """
+    runs = []
+    buf = set()
+    try:
+        for item in items:
+            buf.add(item)
+            if len(buf) >= run_size:
+                fd = tempfile.TemporaryFile(dir=tmpdir)
+                for x in sorted(buf):
+                    marshal.dump(x, fd)
+                runs.append(fd)
+                buf = set()
+        if not runs:
+            for item in sorted(buf):
+                yield item
+            return
+        last = sorted(buf)
+        buf = None
+        for item in merge_unique(last, *[_read_run(fd) for fd in runs]):
+            yield item
+    finally:
+        for fd in runs:
+            fd.close()
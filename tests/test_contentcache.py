@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+#
+# distromatch - Match binary package names across distributions
+#
+# Copyright (C) 2011  Enrico Zini <enrico@enricozini.org>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import unittest
+import os
+import shutil
+import tempfile
+import dmatch.contentcache as contentcache
+from dmatch import utils
+
+ROWS = sorted([
+    ("gimp", "bin", "gimp"),
+    ("gimp", "desktop", "gimp.desktop"),
+    ("gimp", "man", "man1/gimp.1.gz"),
+    ("libgtk2.0-0", "shlib", "libgtk-x11-2.0.so.0"),
+    ("libgtk2.0-dev", "pc", "gtk+-2.0"),
+    ("python-xapian", "py", "xapian/__init__.py"),
+    ("zsh", "bin", "zsh"),
+])
+
+class TestContentsCache(unittest.TestCase):
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.workdir)
+
+    def write(self, name, rows):
+        fname = os.path.join(self.workdir, name)
+        self.assertEqual(contentcache.write(fname, rows), len(rows))
+        return contentcache.ContentsCache(fname)
+
+    def testRoundTrip(self):
+        cache = self.write("test.dmcc", ROWS)
+        self.assertEqual(len(cache), len(ROWS))
+        self.assertEqual(list(cache), ROWS)
+        for idx, row in enumerate(ROWS):
+            self.assertEqual(cache[idx], row)
+        self.assertRaises(IndexError, cache.__getitem__, len(ROWS))
+        cache.close()
+
+    def testEmpty(self):
+        cache = self.write("empty.dmcc", [])
+        self.assertEqual(len(cache), 0)
+        self.assertEqual(list(cache), [])
+        cache.close()
+
+    def testMerge(self):
+        a = self.write("a.dmcc", ROWS[::2])
+        b = self.write("b.dmcc", ROWS[1:4])
+        self.assertEqual(list(utils.merge_unique(a, b)), sorted(set(ROWS[::2] + ROWS[1:4])))
+
+    def testBadFile(self):
+        fname = os.path.join(self.workdir, "bad.dmcc")
+        with open(fname, "w") as fd:
+            fd.write("pkg kind path\n" * 10)
+        self.assertRaises(ValueError, contentcache.ContentsCache, fname)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+#
+# distromatch - Match binary package names across distributions
+#
+# Copyright (C) 2011  Enrico Zini <enrico@enricozini.org>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import unittest
+import os, os.path
+import imp
+import gzip
+import shutil
+import tempfile
+import threading
+import email.utils
+import BaseHTTPServer
+import SocketServer
+from cStringIO import StringIO
+
+run_debian_export = imp.load_source("run_debian_export",
+        os.path.join(os.path.dirname(__file__), "..", "scripts", "run-debian-export"))
+
+CONTENTS = {
+    "/sid/Contents-i386.gz": [
+        "usr/bin/foo                      utils/foo",
+        "usr/share/man/man1/foo.1.gz      doc/foo",
+        "usr/lib/libbar.so.1              libs/libbar1",
+        "usr/share/doc/foo/copyright      doc/foo",
+    ],
+    "/sid/Contents-amd64.gz": [
+        "usr/bin/foo                      utils/foo",
+        "usr/lib/pkgconfig/bar.pc         libdevel/libbar-dev",
+    ],
+}
+
+LAST_MODIFIED = 1300000000
+
+def gzipped(lines):
+    buf = StringIO()
+    out = gzip.GzipFile("Contents", "w", fileobj=buf)
+    out.write("Some header text\n\nFILE                LOCATION\n")
+    for line in lines:
+        out.write(line + "\n")
+    out.close()
+    return buf.getvalue()
+
+class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        body = self.server.files.get(self.path, None)
+        if body is None:
+            self.send_response(404)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        etag = '"%s"' % self.path
+        if self.headers.get("If-None-Match") == etag:
+            self.server.not_modified += 1
+            self.send_response(304)
+            self.end_headers()
+            return
+        self.server.downloads += 1
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("Last-Modified", email.utils.formatdate(LAST_MODIFIED, usegmt=True))
+        self.send_header("ETag", etag)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+class Server(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+class TestFetchContents(unittest.TestCase):
+    def setUp(self):
+        self.cachedir = tempfile.mkdtemp()
+        self.server = Server(("127.0.0.1", 0), Handler)
+        self.server.files = dict([(k, gzipped(v)) for k, v in CONTENTS.iteritems()])
+        self.server.downloads = 0
+        self.server.not_modified = 0
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        self.urls = ["http://127.0.0.1:%d%s" % (self.server.server_port, x) for x in sorted(CONTENTS)]
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.cachedir)
+
+    def testFetch(self):
+        intfiles = run_debian_export.IntFiles(self.cachedir)
+        cachefiles = intfiles.cached_all(self.urls, intfiles.read_contents, jobs=2)
+        self.assertEqual(self.server.downloads, 2)
+        self.assertEqual(list(intfiles.read_cache(cachefiles[self.urls[0]])), [
+            ("foo", "bin", "foo"),
+            ("libbar-dev", "pc", "bar"),
+        ])
+        self.assertEqual(list(intfiles.read_cache(cachefiles[self.urls[1]])), [
+            ("foo", "bin", "foo"),
+            ("foo", "man", "man1/foo.1.gz"),
+            ("libbar1", "shlib", "libbar.so.1"),
+        ])
+        self.assertEqual(os.path.getmtime(cachefiles[self.urls[0]]), LAST_MODIFIED)
+
+        # Files that did not change are not downloaded again
+        intfiles = run_debian_export.IntFiles(self.cachedir)
+        self.assertEqual(intfiles.cached_all(self.urls, intfiles.read_contents, jobs=2), cachefiles)
+        self.assertEqual(self.server.downloads, 2)
+        self.assertEqual(self.server.not_modified, 2)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -19,8 +19,60 @@
 
 import unittest
 import sys, os.path
+import shutil
+import tempfile
 import dmatch
 
+class TestDistro(unittest.TestCase):
+    def testLazy(self):
+        d = dmatch.Distro("debian")
+        # Indices are only opened when needed
+        self.assert_("db" not in d.__dict__)
+        self.assert_(d.has_package("libgtkmm-dev"))
+        self.assert_("db" in d.__dict__)
+
+    def testUnreadable(self):
+        # Distributions whose index cannot be opened are skipped
+        root = tempfile.mkdtemp()
+        try:
+            os.makedirs(os.path.join(root, "dist-broken", "db"))
+            with open(os.path.join(root, "dist-broken", "style"), "w") as fd:
+                print >>fd, "debian"
+            self.assertEqual(dmatch.Distros(root=root).distros, [])
+        finally:
+            shutil.rmtree(root)
+
+    def testCounts(self):
+        d = dmatch.Distros().distro_map["debian"]
+        count_packages, info = d.counts()
+        self.assertEqual(count_packages, len(d.all_packages()))
+        self.assertEqual(sorted(info), sorted(d.count_terms(d.db)))
+
+    def testPostings(self):
+        d = dmatch.Distros().distro_map["fedora"]
+        expected = [d.db.get_document(p.docid).get_data() for p in d.db.postlist("XFBgimp")]
+        self.assertEqual(list(d.term_packages("XFBgimp")), expected)
+        self.assertEqual(list(d.term_packages("XFBgimp")), expected)
+        self.assertEqual((d.postings.hits, d.postings.misses), (1, 1))
+        # Reopening the database drops the cached postings
+        d.__dict__.pop("db")
+        self.assertEqual(list(d.term_packages("XFBgimp")), expected)
+        self.assertEqual((d.postings.hits, d.postings.misses), (0, 1))
+
+    def testPostingCache(self):
+        cache = dmatch.PostingCache(max_size=3)
+        cache.put("a", ("x", "y"))
+        cache.put("b", ("z",))
+        self.assertEqual(cache.get("a"), ("x", "y"))
+        # Storing c evicts b, the least recently used
+        cache.put("c", ("w",))
+        self.assertEqual(cache.get("b"), None)
+        self.assertEqual(cache.size, 3)
+        # Entries larger than the whole cache are not stored
+        cache.put("d", ("1", "2", "3", "4"))
+        self.assertEqual(cache.get("d"), None)
+        self.assertEqual(cache.get("c"), ("w",))
+
 class TestMatcherFromDebian(unittest.TestCase):
     def setUp(self):
         self.distros = dmatch.Distros()
@@ -72,5 +124,122 @@ class TestMatcherFromFedora(unittest.TestCase):
         self.assertEqual(sorted(res["mandriva"]), ['lib64openssl1.0.0', 'libopenssl1.0.0', "openssl"])
         self.assertEqual(sorted(res["suse"]), ['libopenssl1_0_0', 'openssl', 'openssl-doc'])
 
+class TestBulkMatcher(unittest.TestCase):
+    def setUp(self):
+        self.distros = dmatch.Distros()
+
+    def testSameResults(self):
+        for start, names in (
+                ("debian", ["libgtkmm-dev", "libdigest-sha1-perl"]),
+                ("fedora", ["openoffice.org-calc", "xpaint", "xapian-bindings-python", "glibc", "openssl"])):
+            matcher = self.distros.make_matcher(start=start)
+            bulk = self.distros.make_matcher(start=start, bulk=True)
+            for name in names:
+                self.assertEqual(bulk.match(name), matcher.match(name))
+            self.assertEqual(bulk.counts, matcher.counts)
+            self.assertEqual(bulk.count_matchcounts, matcher.count_matchcounts)
+
+class TestFusedMatcher(unittest.TestCase):
+    def setUp(self):
+        self.distros = dmatch.Distros()
+
+    def testSameResults(self):
+        for start, names in (
+                ("debian", ["libgtkmm-dev", "libdigest-sha1-perl"]),
+                ("fedora", ["openoffice.org-calc", "xpaint", "xapian-bindings-python", "glibc", "openssl"])):
+            matcher = self.distros.make_matcher(start=start)
+            fused = self.distros.make_matcher(start=start, fused=True)
+            for name in names:
+                self.assertEqual(fused.match(name), matcher.match(name))
+            self.assertEqual(fused.counts, matcher.counts)
+            self.assertEqual(fused.count_matchcounts, matcher.count_matchcounts)
+
+class TestQueryBudget(unittest.TestCase):
+    def setUp(self):
+        self.distros = dmatch.Distros()
+
+    def testSelect(self):
+        db = self.distros.distro_map["fedora"].db
+        terms = ["XFBls", "XFBgimp", "XFBdoesnotexist"]
+        budget = dmatch.QueryBudget()
+        self.assertEqual(sorted(budget.select(terms, db)), ["XFBgimp", "XFBls"])
+        budget = dmatch.QueryBudget(max_terms=1)
+        self.assertEqual(budget.select(terms, db), ["XFBgimp"])
+
+    def testAllCommon(self):
+        # The most selective term is kept even if all are too common
+        db = self.distros.distro_map["fedora"].db
+        budget = dmatch.QueryBudget(max_df=0.0)
+        self.assertEqual(budget.select(["XFBls", "XFBgimp"], db), ["XFBgimp"])
+
+    def testUnlimited(self):
+        matcher = self.distros.make_matcher(start="fedora")
+        budgeted = self.distros.make_matcher(start="fedora", budget=dmatch.QueryBudget())
+        names = ["glibc", "openssl", "xpaint"]
+        self.assertEqual(list(dmatch.budget_changes(matcher, budgeted, names)), [])
+
+class TestMatchProfile(unittest.TestCase):
+    def setUp(self):
+        self.distros = dmatch.Distros()
+
+    def testProfile(self):
+        names = ["glibc", "openssl", "xpaint"]
+        seen = []
+        profile = dmatch.MatchProfile(top=2, hook=lambda name, seconds, calls: seen.append(name))
+        matcher = self.distros.make_matcher(start="fedora")
+        profiled = self.distros.make_matcher(start="fedora", profile=profile)
+        for name in names:
+            self.assertEqual(profiled.match(name), matcher.match(name))
+        self.assertEqual(seen, names)
+
+        info = profile.as_dict()
+        self.assertEqual(info["packages"], len(names))
+        self.assertEqual(len(info["slowest"]), 2)
+        meths = set([m["method"] for m in info["methods"]])
+        self.assert_("byname" in meths)
+        self.assert_(sum([m["queries"] for m in info["methods"]]) > 0)
+        # Queries answered from the posting cache are counted as well
+        for m in info["methods"]:
+            self.assert_(m["cached_queries"] <= m["queries"])
+
+class TestMatchCache(unittest.TestCase):
+    def setUp(self):
+        self.distros = dmatch.Distros()
+        self.cachedir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.cachedir)
+
+    def testCache(self):
+        names = ["openoffice.org-calc", "xpaint", "xapian-bindings-python", "glibc"]
+        matcher = self.distros.make_matcher(start="fedora")
+        expected = [matcher.match(name) for name in names]
+
+        cached = self.distros.make_matcher(start="fedora", cachedir=self.cachedir)
+        self.assertEqual([cached.match(name) for name in names], expected)
+        cached.close()
+
+        # Results come from the cache, with the same statistics
+        cached = self.distros.make_matcher(start="fedora", cachedir=self.cachedir)
+        cached.match_distros = None
+        self.assertEqual([cached.match(name) for name in names], expected)
+        self.assertEqual(cached.counts, matcher.counts)
+        self.assertEqual(cached.count_matchcounts, matcher.count_matchcounts)
+        self.assertEqual(cached.cache.hits, len(names))
+        cached.close()
+
+        # Reindexing a distribution only recomputes its matches
+        cached = self.distros.make_matcher(start="fedora", cachedir=self.cachedir)
+        cached.generations["debian"] = "reindexed"
+        orig = cached.match_distros
+        computed = []
+        def match_distros(name, distros):
+            computed.extend([d.name for d in distros])
+            return orig(name, distros)
+        cached.match_distros = match_distros
+        self.assertEqual([cached.match(name) for name in names], expected)
+        self.assertEqual(computed, ["debian"] * len(names))
+        cached.close()
+
 if __name__ == '__main__':
     unittest.main()
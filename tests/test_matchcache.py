@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+#
+# distromatch - Match binary package names across distributions
+#
+# Copyright (C) 2011  Enrico Zini <enrico@enricozini.org>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import unittest
+import shutil
+import tempfile
+import os.path
+from dmatch.matchcache import MatchCache
+
+class TestMatchCache(unittest.TestCase):
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.workdir)
+
+    def testShared(self):
+        # A writer and a reader using the same file at the same time
+        writer = MatchCache.for_pivot(self.workdir, "debian", sync_every=2)
+        reader = MatchCache.for_pivot(self.workdir, "debian")
+        self.assertEqual(reader.get("gimp"), None)
+        writer.put("gimp", ("gen", dict(fedora=["gimp"])))
+        # Not written to disk yet
+        self.assertEqual(reader.get("gimp"), None)
+        writer.put("zsh", ("gen", dict(fedora=["zsh"])))
+        self.assertEqual(reader.get("gimp"), ("gen", dict(fedora=["gimp"])))
+
+        other = MatchCache.for_pivot(self.workdir, "debian")
+        other.put("xpaint", ("gen", dict()))
+        other.close()
+        writer.put("bash", ("gen", dict()))
+        writer.close()
+        self.assertEqual(reader.get("xpaint"), ("gen", dict()))
+        self.assertEqual(reader.get("bash"), ("gen", dict()))
+        self.assertEqual((reader.hits, reader.misses), (3, 2))
+        reader.close()
+
+    def testReopen(self):
+        writer = MatchCache.for_pivot(self.workdir, "debian", sync_every=1)
+        reader = MatchCache.for_pivot(self.workdir, "debian")
+        writer.put("gimp", ("gen", dict()))
+        self.assertEqual(reader.get("zsh"), None)
+        # The file is only reopened after another write
+        db = reader.db
+        self.assertEqual(reader.get("bash"), None)
+        self.assert_(reader.db is db)
+        writer.put("zsh", ("gen", dict()))
+        self.assertEqual(reader.get("zsh"), ("gen", dict()))
+        self.assert_(reader.db is not db)
+        writer.close()
+        reader.close()
+
+    def testUnicode(self):
+        # Names decoded from JSON are unicode
+        cache = MatchCache.for_pivot(self.workdir, "debian", sync_every=1)
+        cache.put(u"gimp", ("gen", dict()))
+        cache.close()
+        cache = MatchCache.for_pivot(self.workdir, "debian")
+        self.assertEqual(cache.get(u"gimp"), ("gen", dict()))
+        self.assertEqual(cache.get("gimp"), ("gen", dict()))
+        cache.close()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+#
+# distromatch - Match binary package names across distributions
+#
+# Copyright (C) 2011  Enrico Zini <enrico@enricozini.org>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import unittest
+import os
+import shutil
+import tempfile
+import dmatch.matchtable as matchtable
+
+DISTROS = [("fedora", "gen-f"), ("debian", "gen-d"), ("suse", "gen-s")]
+METHODS = ["ByName", "ByShlib", "ByStemmer"]
+ROWS = [
+    ("bash", 1, dict(fedora=set(["bash"]), suse=set(["bash"]))),
+    ("libc6", 2, dict(fedora=set(["glibc"]), suse=set(["glibc", "glibc-32bit"]))),
+    ("nomatch", 0, dict()),
+]
+
+class TestMatchTable(unittest.TestCase):
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp()
+        self.fname = os.path.join(self.workdir, "debian.dmt")
+        matchtable.write(self.fname, "debian", DISTROS, METHODS, ROWS)
+
+    def tearDown(self):
+        shutil.rmtree(self.workdir)
+
+    def testRoundTrip(self):
+        table = matchtable.MatchTable(self.fname)
+        try:
+            self.assertEquals(table.pivot, "debian")
+            self.assertEquals(table.count, 3)
+            self.assertEquals(table.methods, METHODS)
+            for name, mask, matches in ROWS:
+                row = table.lookup(name)
+                self.assertEquals(table.name(row), name)
+                meths, found = table.matches(row)
+                self.assertEquals(meths, [m for i, m in enumerate(METHODS) if mask & (1 << i)])
+                self.assertEquals(found, matches)
+            self.assertEquals(table.lookup("zsh"), None)
+        finally:
+            table.close()
+
+    def testValidity(self):
+        gens = dict(DISTROS)
+        table = matchtable.open_table(self.workdir, "debian", gens)
+        self.assert_(table is not None)
+        table.close()
+        gens["suse"] = "gen-s2"
+        self.assertEquals(matchtable.open_table(self.workdir, "debian", gens), None)
+        self.assertEquals(matchtable.open_table(self.workdir, "debian", dict(DISTROS[:2])), None)
+        self.assertEquals(matchtable.open_table(self.workdir, "fedora", dict(DISTROS)), None)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+#
+# distromatch - Match binary package names across distributions
+#
+# Copyright (C) 2011  Enrico Zini <enrico@enricozini.org>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import unittest
+import os
+import shutil
+import tempfile
+from gzip import GzipFile
+import dmatch.merge as merge
+
+def write(path, lines):
+    if path.endswith(".gz"):
+        fd = GzipFile(path, "w")
+    else:
+        fd = open(path, "w")
+    for line in lines:
+        fd.write(line + "\n")
+    fd.close()
+
+def read(path):
+    return [line.rstrip("\n") for line in GzipFile(path, "r")]
+
+class TestMerge(unittest.TestCase):
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp()
+        self.dirs = []
+        for name in "target", "a", "b":
+            path = os.path.join(self.workdir, name)
+            os.mkdir(path)
+            self.dirs.append(path)
+
+    def tearDown(self):
+        shutil.rmtree(self.workdir)
+
+    def testSorted(self):
+        target, a, b = self.dirs
+        write(os.path.join(a, "binsrc.gz"), ["bash bash", "libc6 glibc", "zsh zsh"])
+        write(os.path.join(b, "binsrc"), ["Bash bash", "bash bash", "coreutils coreutils"])
+        res = merge.merge_datadirs(target, [a, b], jobs=1)
+        self.assertEquals(res, dict(binsrc=5, **{"interesting-files": None}))
+        self.assertEquals(read(os.path.join(target, "binsrc.gz")),
+                ["Bash bash", "bash bash", "coreutils coreutils", "libc6 glibc", "zsh zsh"])
+        self.assert_(not os.path.exists(os.path.join(target, "interesting-files.gz")))
+
+    def testUnsorted(self):
+        target, a, b = self.dirs
+        write(os.path.join(a, "interesting-files.gz"), ["gimp bin gimp", "bash bin bash"])
+        write(os.path.join(b, "interesting-files.gz"), ["bash bin bash", "bash man man1/bash.1.gz"])
+        merge.merge_file(target, [a, b], "interesting-files")
+        self.assertEquals(read(os.path.join(target, "interesting-files.gz")),
+                ["bash bin bash", "bash man man1/bash.1.gz", "gimp bin gimp"])
+
+if __name__ == '__main__':
+    unittest.main()
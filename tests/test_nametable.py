@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+#
+# distromatch - Match binary package names across distributions
+#
+# Copyright (C) 2011  Enrico Zini <enrico@enricozini.org>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import unittest
+import os
+import shutil
+import tempfile
+import dmatch.nametable as nametable
+
+ITEMS = [("bash", [3]), ("libc6", [1]), ("python-foo", [7, 9]), ("zsh", [12])]
+
+class TestNameTable(unittest.TestCase):
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp()
+        self.fname = os.path.join(self.workdir, "names.dmnt")
+        nametable.write(self.fname, "gen1", ITEMS)
+
+    def tearDown(self):
+        shutil.rmtree(self.workdir)
+
+    def testLookup(self):
+        table = nametable.NameTable(self.fname)
+        try:
+            self.assertEquals(len(table), 4)
+            self.assertEquals(table.generation, "gen1")
+            self.assertEquals(table.lookup("bash"), 3)
+            self.assertEquals(table.lookup("zsh"), 12)
+            self.assertEquals(table.lookup("python-foo"), nametable.AMBIGUOUS)
+            self.assertEquals(table.lookup("tcsh"), None)
+            self.assertEquals(table.lookup(""), None)
+        finally:
+            table.close()
+
+    def testGeneration(self):
+        table = nametable.open_table(self.fname, "gen1")
+        self.assert_(table is not None)
+        table.close()
+        self.assertEquals(nametable.open_table(self.fname, "gen2"), None)
+        self.assertEquals(nametable.open_table(self.fname, None), None)
+
+if __name__ == '__main__':
+    unittest.main()
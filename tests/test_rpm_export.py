@@ -0,0 +1,194 @@
+# -*- coding: utf-8 -*-
+#
+# distromatch - Match binary package names across distributions
+#
+# Copyright (C) 2011  Enrico Zini <enrico@enricozini.org>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import unittest
+import os, os.path
+import sys
+import imp
+import gzip
+import hashlib
+import shutil
+import tempfile
+import optparse
+import subprocess
+
+rpm_export = imp.load_source("rpm_export",
+        os.path.join(os.path.dirname(__file__), "..", "scripts", "rpm-export"))
+
+PRIMARY = """<?xml version="1.0" encoding="UTF-8"?>
+<metadata xmlns="http://linux.duke.edu/metadata/common" xmlns:rpm="http://linux.duke.edu/metadata/rpm" packages="3">
+<package type="rpm">
+  <name>gtk2-devel</name>
+  <arch>i686</arch>
+  <checksum type="sha256" pkgid="YES">aaaa</checksum>
+  <format>
+    <rpm:sourcerpm>gtk2-2.24.8-3.fc16.src.rpm</rpm:sourcerpm>
+    <rpm:provides>
+      <rpm:entry name="pkgconfig(gtk+-2.0)"/>
+      <rpm:entry name="gtk2-devel"/>
+    </rpm:provides>
+    <file>/usr/bin/gtk-builder-convert</file>
+  </format>
+</package>
+<package type="rpm">
+  <name>gimp</name>
+  <arch>i686</arch>
+  <checksum type="sha256" pkgid="YES">bbbb</checksum>
+  <format>
+    <rpm:sourcerpm>gimp-2.6.11-21.fc16.src.rpm</rpm:sourcerpm>
+    <file>/usr/bin/gimp</file>
+  </format>
+</package>
+<package type="rpm">
+  <name>gimp-debuginfo</name>
+  <arch>i686</arch>
+  <checksum type="sha256" pkgid="YES">cccc</checksum>
+  <format>
+    <rpm:sourcerpm>gimp-2.6.11-21.fc16.src.rpm</rpm:sourcerpm>
+  </format>
+</package>
+</metadata>
+"""
+
+FILELISTS = """<?xml version="1.0" encoding="UTF-8"?>
+<filelists xmlns="http://linux.duke.edu/metadata/filelists" packages="3">
+<package pkgid="bbbb" name="gimp" arch="i686">
+  <file>/usr/bin/gimp</file>
+  <file>/usr/share/applications/gimp.desktop</file>
+  <file type="dir">/usr/share/gimp</file>
+</package>
+<package pkgid="cccc" name="gimp-debuginfo" arch="i686">
+  <file>/usr/lib/debug/usr/bin/gimp.debug</file>
+</package>
+<package pkgid="dddd" name="unknown" arch="i686">
+  <file>/usr/bin/unknown</file>
+</package>
+</filelists>
+"""
+
+REPOMD = """<?xml version="1.0" encoding="UTF-8"?>
+<repomd xmlns="http://linux.duke.edu/metadata/repo">
+  <data type="primary">
+    <checksum type="sha256">%s</checksum>
+    <location href="repodata/primary.xml.gz"/>
+  </data>
+  <data type="filelists">
+    <checksum type="sha256">%s</checksum>
+    <location href="repodata/filelists.xml.gz"/>
+  </data>
+</repomd>
+"""
+
+def make_repo(root):
+    "Create a minimal rpm-md repository in root"
+    repodata = os.path.join(root, "repodata")
+    os.makedirs(repodata)
+    hashes = []
+    for name, contents in (("primary.xml.gz", PRIMARY), ("filelists.xml.gz", FILELISTS)):
+        fname = os.path.join(repodata, name)
+        out = gzip.GzipFile(fname, "w")
+        out.write(contents)
+        out.close()
+        hashes.append(hashlib.sha256(open(fname).read()).hexdigest())
+    with open(os.path.join(repodata, "repomd.xml"), "w") as fd:
+        fd.write(REPOMD % tuple(hashes))
+
+class TestRpmMd(unittest.TestCase):
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp()
+        self.repo = os.path.join(self.workdir, "repo")
+        make_repo(self.repo)
+
+    def tearDown(self):
+        shutil.rmtree(self.workdir)
+
+    def testParse(self):
+        md = rpm_export.RpmMd(self.repo, None)
+        md.fetch_and_parse()
+        pkgs = dict((p.name, p) for p in md.packages)
+        self.assertEqual(sorted(pkgs.keys()), ["gimp", "gtk2-devel"])
+        self.assertEqual(pkgs["gimp"].src_package, "gimp")
+        # The file list replaces the files from primary
+        self.assertEqual(pkgs["gimp"].interesting, set([("bin", "gimp"), ("desktop", "gimp.desktop")]))
+        self.assertEqual(pkgs["gtk2-devel"].interesting, set([("pc", "gtk+-2.0"), ("bin", "gtk-builder-convert")]))
+
+    def testExport(self):
+        md = rpm_export.RpmMd(self.repo, None)
+        md.fetch_and_parse()
+        outdir = os.path.join(self.workdir, "out")
+        md.export_data("fedora-test", "fedora", outdir=outdir)
+        distdir = os.path.join(outdir, "dist-fedora-test")
+        self.assertEqual(open(os.path.join(distdir, "style")).read(), "fedora\n")
+        self.assertEqual(gzip.GzipFile(os.path.join(distdir, "binsrc.gz")).read().splitlines(), [
+            "gimp gimp", "gtk2-devel gtk2"])
+        self.assertEqual(gzip.GzipFile(os.path.join(distdir, "interesting-files.gz")).read().splitlines(), [
+            "gimp bin gimp", "gimp desktop gimp.desktop",
+            "gtk2-devel bin gtk-builder-convert", "gtk2-devel pc gtk+-2.0"])
+
+class TestExportRepo(unittest.TestCase):
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp()
+        self.repo = os.path.join(self.workdir, "repo")
+        make_repo(self.repo)
+        self.outdir = os.path.join(self.workdir, "out")
+        self.opts = optparse.Values(dict(
+            distro_style="fedora", metadata_type="auto", outdir=self.outdir,
+            cachedir=os.path.join(self.workdir, "cache"), force=False))
+
+    def tearDown(self):
+        shutil.rmtree(self.workdir)
+
+    def testSkipUnchanged(self):
+        self.assertEqual(rpm_export.export_repo(self.repo, "test", self.opts), (0, None))
+        manifest = rpm_export.read_manifest(self.outdir, "test")
+        self.assertEqual(manifest[-1], "style fedora")
+
+        # Running again does not parse the metadata
+        orig = rpm_export.RpmMd.fetch_and_parse
+        parsed = []
+        def fetch_and_parse(md):
+            parsed.append(md.resource)
+            return orig(md)
+        rpm_export.RpmMd.fetch_and_parse = fetch_and_parse
+        try:
+            self.assertEqual(rpm_export.export_repo(self.repo, "test", self.opts), (0, None))
+            self.assertEqual(parsed, [])
+
+            # --force exports anyway
+            self.opts.force = True
+            self.assertEqual(rpm_export.export_repo(self.repo, "test", self.opts), (0, None))
+            self.assertEqual(parsed, [self.repo])
+        finally:
+            rpm_export.RpmMd.fetch_and_parse = orig
+        self.assertEqual(rpm_export.read_manifest(self.outdir, "test"), manifest)
+
+    def testMultipleRepos(self):
+        script = os.path.join(os.path.dirname(__file__), "..", "scripts", "rpm-export")
+        proc = subprocess.Popen([sys.executable, script, "--jobs=2", "--distro-style=fedora",
+                                 "--outdir=" + self.outdir, "--cachedir=" + self.opts.cachedir,
+                                 self.repo, "test1", self.repo, "test2"])
+        self.assertEqual(proc.wait(), 0)
+        for tag in "test1", "test2":
+            distdir = os.path.join(self.outdir, "dist-" + tag)
+            self.assertEqual(gzip.GzipFile(os.path.join(distdir, "binsrc.gz")).read().splitlines(), [
+                "gimp gimp", "gtk2-devel gtk2"])
+            self.assertTrue(os.path.exists(os.path.join(distdir, "manifest")))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+#
+# distromatch - Match binary package names across distributions
+#
+# Copyright (C) 2011  Enrico Zini <enrico@enricozini.org>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import unittest
+import dmatch.rules as rules
+
+PATHS = [
+    "usr/share/applications/gimp.desktop",
+    "./usr/share/applications/kde4/dolphin.desktop",
+    "/usr/share/applications/README",
+    "usr/bin/gimp",
+    "bin/ls",
+    "/usr/bin/python2.7",
+    "usr/sbin/sshd",
+    "usr/lib/pkgconfig/gtk+-2.0.pc",
+    "usr/share/pkgconfig/xproto.pc",
+    "usr/lib/x86_64-linux-gnu/pkgconfig/glib-2.0.pc",
+    "lib/libc.so.6",
+    "usr/lib/libgtk-x11-2.0.so.0.2400.10",
+    "usr/lib64/libssl.so.1.0.0",
+    "usr/lib/libfoo.so",
+    "usr/lib/libfoo.a",
+    "usr/lib32/libbar.a",
+    "usr/lib/libfoo.so.1.a",
+    "usr/share/man/man1/ls.1.gz",
+    "./usr/share/man/it/man8/foo.8.gz",
+    "usr/lib/python2.7/dist-packages/xapian/__init__.py",
+    "usr/share/python2.6/site-packages/foo.py",
+    "usr/lib64/python2.7/site-packages/bar/baz.pyc",
+    "usr/share/doc/gimp/copyright",
+    "etc/passwd",
+    "",
+]
+
+PROVIDES = [
+    "pkgconfig(gtk+-2.0)",
+    "libc.so.6",
+    "libc.so.6(GLIBC_2.0)",
+    "perl(Foo::Bar)",
+    "/usr/bin/foo",
+]
+
+class TestContentClassifier(unittest.TestCase):
+    def testMatchAll(self):
+        for path in PATHS:
+            expected = []
+            for kind, matcher in rules.CONTENT_INFO.iteritems():
+                m = matcher.match(path)
+                if m:
+                    expected.append((kind, m))
+            self.assertEqual(rules.CONTENT_CLASSIFIER.match_all(path), expected)
+
+    def testMatchFirst(self):
+        for path in PATHS:
+            expected = None
+            for kind, matcher in rules.CONTENT_INFO.iteritems():
+                m = matcher.match(path)
+                if m:
+                    expected = (kind, m)
+                    break
+            self.assertEqual(rules.CONTENT_CLASSIFIER.match(path), expected)
+
+    def testProvides(self):
+        for provide in PROVIDES:
+            expected = None
+            for kind, matcher in rules.CONTENT_INFO.iteritems():
+                if not matcher.rpm_md: continue
+                mo = matcher.rpm_md.match(provide)
+                if mo:
+                    expected = (kind, mo.group(1))
+                    break
+            self.assertEqual(rules.PROVIDES_CLASSIFIER.match(provide), expected)
+
+    def testBatch(self):
+        expected = []
+        for idx, path in enumerate(PATHS):
+            for kind, m in rules.CONTENT_CLASSIFIER.match_all(path):
+                expected.append((idx, kind, m))
+        self.assertEqual(rules.CONTENT_CLASSIFIER.match_batch(PATHS), expected)
+
+if __name__ == '__main__':
+    unittest.main()
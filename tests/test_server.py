@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+#
+# distromatch - Match binary package names across distributions
+#
+# Copyright (C) 2011  Enrico Zini <enrico@enricozini.org>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import unittest
+import json
+import shutil
+import tempfile
+import threading
+import urllib2
+import dmatch
+import dmatch.server as server
+
+class TestService(unittest.TestCase):
+    def setUp(self):
+        self.service = server.Service(distros=dmatch.Distros())
+
+    def testQueries(self):
+        res = self.service.query("match", "debian", ["libgtkmm-dev", "this-does-not-exist"])
+        self.assertEqual(res[0]["package"], "libgtkmm-dev")
+        self.assertEqual(res[0]["matches"]["fedora"], ["gtkmm24-devel"])
+        self.assertEqual(res[1], dict(package="this-does-not-exist", found=False))
+
+        res = self.service.query("has-package", "fedora", ["xpaint"])
+        self.assertEqual(res, [dict(package="xpaint", found=True)])
+
+        res = self.service.query("dump", "fedora", ["xpaint"])
+        self.assert_("package name:" in res[0]["info"])
+
+        self.assertRaises(server.QueryError, self.service.query, "match", "nope", ["xpaint"])
+        self.assertRaises(server.QueryError, self.service.query, "nope", "debian", ["xpaint"])
+
+    def testHTTP(self):
+        srv = server.make_server("127.0.0.1:0", self.service)
+        thread = threading.Thread(target=srv.serve_forever)
+        thread.daemon = True
+        thread.start()
+        try:
+            base = "http://127.0.0.1:%d" % srv.server_port
+            res = json.loads(urllib2.urlopen(base + "/match?distro=fedora&pkg=xpaint").read())
+            self.assertEqual(res["results"][0]["matches"]["debian"], ["xpaint"])
+
+            req = urllib2.Request(base + "/batch", json.dumps(dict(requests=[
+                dict(op="has-package", distro="debian", packages=["libgtkmm-dev"]),
+                dict(op="match", distro="nope", packages=["xpaint"]),
+            ])))
+            res = json.loads(urllib2.urlopen(req).read())
+            self.assertEqual(res["responses"][0]["results"], [dict(package="libgtkmm-dev", found=True)])
+            self.assert_("error" in res["responses"][1])
+        finally:
+            srv.shutdown()
+            srv.server_close()
+
+class TestCachedService(unittest.TestCase):
+    def setUp(self):
+        self.cachedir = tempfile.mkdtemp()
+        self.service = server.Service(distros=dmatch.Distros(), cachedir=self.cachedir)
+
+    def tearDown(self):
+        shutil.rmtree(self.cachedir)
+
+    def testBatch(self):
+        # Package names decoded from JSON are unicode
+        requests = json.loads(json.dumps([dict(op="match", distro="fedora", packages=["xpaint", "glibc"])]))
+        for i in range(2):
+            res = self.service.batch(requests)
+            self.assertEqual(res[0]["results"][0]["matches"]["debian"], ["xpaint"])
+        self.service.snapshot.close()
+
+        cache = dmatch.MatchCache.for_pivot(self.cachedir, "fedora")
+        self.assert_(cache.get("xpaint") is not None)
+        cache.close()
+
+if __name__ == '__main__':
+    unittest.main()
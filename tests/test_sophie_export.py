@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+#
+# distromatch - Match binary package names across distributions
+#
+# Copyright (C) 2011  Enrico Zini <enrico@enricozini.org>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import unittest
+import os, os.path
+import imp
+import gzip
+import shutil
+import sqlite3
+import tempfile
+import multiprocessing
+
+sophie_export = imp.load_source("sophie_export",
+        os.path.join(os.path.dirname(__file__), "..", "scripts", "sophie-export"))
+
+# Stand-in for the release tables of the Sophie database
+SCHEMA = """
+CREATE TABLE distributions (distributions_key INTEGER PRIMARY KEY, name TEXT);
+CREATE TABLE d_release (d_release_key INTEGER PRIMARY KEY, version TEXT, distributions INTEGER);
+INSERT INTO distributions VALUES (1, 'Mandriva');
+INSERT INTO d_release VALUES (10, '2010.1', 1);
+INSERT INTO d_release VALUES (11, 'Cooker', 1);
+"""
+
+# rk, pkgid, binname, srcname
+PACKAGES = [
+    (10, "cc", "gimp", "gimp"),
+    (11, "cc", "gimp", "gimp"),
+    (11, "aa", "zsh", "zsh"),
+    (10, "bb", "libgtk2.0_0", "gtk+2.0"),
+    (99, "dd", "unknown", "unknown"),
+]
+
+# pkgid, kind, fname
+FILES = [
+    ("cc", "bin", "gimp"),
+    ("ee", "bin", "orphan"),
+    ("aa", "bin", "zsh"),
+    ("cc", "desktop", "gimp.desktop"),
+    ("dd", "bin", "unknown"),
+]
+
+class TestJoin(unittest.TestCase):
+    def testJoin(self):
+        left = [("a", 1), ("b", 2), ("b", 3), ("d", 4)]
+        right = [("a", "x"), ("c", "y"), ("d", "z"), ("d", "w"), ("e", "v")]
+        self.assertEqual(list(sophie_export.join_sorted(left, right)), [
+            ("a", [("a", 1)], [("a", "x")]),
+            ("b", [("b", 2), ("b", 3)], []),
+            ("d", [("d", 4)], [("d", "z"), ("d", "w")]),
+        ])
+        self.assertEqual(list(sophie_export.join_sorted([], right)), [])
+        self.assertEqual(list(sophie_export.join_sorted(left[:1], [])), [("a", [("a", 1)], [])])
+
+class TestPipeline(unittest.TestCase):
+    def batches(self):
+        paths = ["usr/bin/foo", "usr/share/doc/foo/copyright", "usr/share/applications/foo.desktop",
+                 "usr/lib/libfoo.so.1", "etc/foo.conf"]
+        for i in range(20):
+            pkgids = ["pkg%02d%d" % (i, x) for x in range(len(paths))]
+            yield pkgids, paths
+
+    def testFetcher(self):
+        fetcher = sophie_export.BatchFetcher(self.batches(), queue_size=2)
+        fetcher.start()
+        self.assertEqual(list(fetcher), list(self.batches()))
+        fetcher.stop()
+
+        # Stopping before the end does not block
+        fetcher = sophie_export.BatchFetcher(self.batches(), queue_size=2)
+        fetcher.start()
+        iter(fetcher).next()
+        fetcher.stop()
+        self.assertFalse(fetcher.is_alive())
+
+    def testFetcherError(self):
+        def batches():
+            yield ["a"], ["usr/bin/a"]
+            raise RuntimeError("database went away")
+        fetcher = sophie_export.BatchFetcher(batches())
+        fetcher.start()
+        self.assertRaises(RuntimeError, list, fetcher)
+        fetcher.stop()
+
+    def testClassify(self):
+        serial = [(b.count_read, b.matches) for b, elapsed in sophie_export.classify_batches(self.batches())]
+        self.assertEqual(len(serial), 20)
+        self.assertEqual(serial[0], (5, [("pkg000", "bin", "foo"), ("pkg002", "desktop", "foo.desktop"), ("pkg003", "shlib", "libfoo.so.1")]))
+        pool = multiprocessing.Pool(2)
+        try:
+            parallel = [(b.count_read, b.matches) for b, elapsed in sophie_export.classify_batches(self.batches(), pool, window=3)]
+        finally:
+            pool.terminate()
+            pool.join()
+        self.assertEqual(parallel, serial)
+
+class TestExport(unittest.TestCase):
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp()
+        self.cachedir = os.path.join(self.workdir, "cache")
+        self.outdir = os.path.join(self.workdir, "out")
+        os.mkdir(self.cachedir)
+        os.mkdir(self.outdir)
+        # Fresh caches, so that the package and file lists are not queried
+        out = gzip.GzipFile(os.path.join(self.cachedir, "all-packages.gz"), "w")
+        for row in PACKAGES:
+            print >>out, " ".join(str(x) for x in row)
+        out.close()
+        out = gzip.GzipFile(os.path.join(self.cachedir, "all-interesting-files.gz"), "w")
+        for row in FILES:
+            print >>out, " ".join(row)
+        out.close()
+        self.db = sqlite3.connect(":memory:")
+        self.db.executescript(SCHEMA)
+
+    def tearDown(self):
+        self.db.close()
+        shutil.rmtree(self.workdir)
+
+    def read(self, tag, name):
+        fname = os.path.join(self.outdir, "dist-" + tag, name)
+        return sorted(gzip.GzipFile(fname).read().splitlines())
+
+    def testExport(self):
+        extractor = sophie_export.Extractor(self.outdir, self.cachedir, db=self.db)
+        extractor.export_data()
+        self.assertEqual(sorted(os.listdir(self.outdir)), ["dist-mandriva-2010.1", "dist-mandriva-cooker"])
+        self.assertEqual(self.read("mandriva-2010.1", "binsrc.gz"), ["gimp gimp", "libgtk2.0_0 gtk+2.0"])
+        self.assertEqual(self.read("mandriva-2010.1", "interesting-files.gz"), [
+            "gimp bin gimp", "gimp desktop gimp.desktop"])
+        self.assertEqual(self.read("mandriva-cooker", "binsrc.gz"), ["gimp gimp", "zsh zsh"])
+        self.assertEqual(self.read("mandriva-cooker", "interesting-files.gz"), [
+            "gimp bin gimp", "gimp desktop gimp.desktop", "zsh bin zsh"])
+
+if __name__ == '__main__':
+    unittest.main()
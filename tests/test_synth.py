@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+#
+# distromatch - Match binary package names across distributions
+#
+# Copyright (C) 2011  Enrico Zini <enrico@enricozini.org>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import unittest
+import os
+import shutil
+import tempfile
+import gzip
+import dmatch.synth as synth
+from dmatch.rules import STEMMERS
+
+class TestSynth(unittest.TestCase):
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.workdir)
+
+    def read(self, name, fname):
+        return [line.rstrip("\n") for line in gzip.GzipFile(os.path.join(self.workdir, "dist-" + name, fname))]
+
+    def testDataset(self):
+        res = synth.write_dataset(self.workdir, packages=300, content_lines=1500)
+        self.assertEquals(sorted(res.keys()), sorted(STEMMERS.keys()))
+        for name, (packages, lines) in res.iteritems():
+            self.assert_(250 < packages < 350, packages)
+            self.assert_(1000 < lines < 2000, lines)
+            self.assertEquals(open(os.path.join(self.workdir, "dist-" + name, "style")).read().strip(), name)
+            for fname, count in ("binsrc.gz", packages), ("interesting-files.gz", lines):
+                data = self.read(name, fname)
+                self.assertEquals(len(data), count)
+                self.assertEquals(data, sorted(data))
+
+    def testStemmers(self):
+        synth.write_dataset(self.workdir, packages=300)
+        for style, stemmers in STEMMERS.iteritems():
+            names = [line.split()[0] for line in self.read(style, "binsrc.gz")]
+            # Every kind of stemmer finds something to stem
+            for pfx, rules in stemmers.iteritems():
+                stemmed = [n for n in names if any(r.stem(n) for r in rules)]
+                self.assert_(stemmed, "%s: nothing stemmed by %s" % (style, pfx))
+
+    def testDeterministic(self):
+        a = synth.make_projects(100, seed=1)
+        b = synth.make_projects(100, seed=1)
+        self.assertEquals([p.name for p in a], [p.name for p in b])
+        self.assertEquals(list(synth.SynthDistro(a, "suse", seed=1)), list(synth.SynthDistro(b, "suse", seed=1)))
+
+if __name__ == '__main__':
+    unittest.main()